@@ -21,9 +21,15 @@
     xhatspikes  : array with hidden state estimate based on spike train
     MI          : mean-squared error between hidden state and hidden state estimate based on spike train
 '''
+import math
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 from scipy import stats, integrate
+try:
+    import numba
+except ImportError:
+    numba = None
 
 def analyze_exp(ron, roff, x, input_theory, dt, theta, spiketrain): #TODO add spiketrain for additional calc
     ''' Analyzes the the hidden state and the input that was created by the ANN to
@@ -43,6 +49,155 @@ def analyze_exp(ron, roff, x, input_theory, dt, theta, spiketrain): #TODO add sp
     return pd.DataFrame.from_dict(Output, orient='index').T
 
 
+def analyze_exp_batch(ron, roff, x, input_theory, dt, theta, spikes, xhat=False, spiketimes=False):
+    ''' Batch version of analyze_exp that analyses all trials at once and returns
+        one table with a row per trial.
+
+        INPUT:
+              x(array): hidden state (ntrials x nt), or (nt) if shared by all trials.
+              input_theory(array): input (ntrials x nt), or (nt) if shared by all trials.
+              spikes(array or list): spiketrains (ntrials x nt) of spike counts per bin, or 
+                                     with spiketimes the spike times (ms) per trial, see 
+                                     calc_MI_ideal_events.
+              xhat(bool): also return the hidden state estimates.
+              spiketimes(bool): spikes are spike times instead of spiketrains.
+        OUTPUT:
+              [results, xhats]: DataFrame with the columns MI_i, MSE_i, MI, MSE, qon and qoff
+                                and a dictionary with the (ntrials x nt) arrays xhat_i and 
+                                xhatspikes (None if xhat is False).
+    '''
+    ntrials = len(spikes)
+    nt = np.shape(x)[-1]
+    x = np.broadcast_to(x, (ntrials, nt))
+    _check_spikes(spikes, nt, spiketimes)
+
+    # Input, once if the input and hidden state are shared
+    if np.ndim(input_theory) == 1 and x.strides[0] == 0:
+        _, _, MI_i, L_i = calc_MI_input(ron, roff, input_theory, theta, x[0], dt)
+        L_i = np.broadcast_to(L_i, (ntrials, nt))
+    else:
+        _, _, MI_i, L_i = calc_MI_input(ron, roff, np.broadcast_to(input_theory, (ntrials, nt)), theta, x, dt)
+    xhat_i = p_conditional(L_i)
+
+    # Output, qon and qoff per trial and L of all spiketrains at once
+    if spiketimes:
+        rates = [spike_rates(_spiketimes_to_train(spikes[n], nt, dt), x[n], dt) for n in range(ntrials)]
+    else:
+        spikes = np.reshape(spikes, (ntrials, nt))
+        rates = [spike_rates(spikes[n], x[n], dt) for n in range(ntrials)]
+    qon, qoff = np.array(rates).T
+    w = np.log(qon/qoff)
+    if spiketimes:
+        L = np.stack([integrate_L_events(np.sort(spikes[n]), ron, roff, qon[n] - qoff[n], w[n], np.arange(nt)*dt)
+                      for n in range(ntrials)])
+    else:
+        L = integrate_L(spikes/dt, ron, roff, qon - qoff, dt, w=w)
+    _, _, MI = MI_est(L, x, axis=-1)
+    xhatspikes = p_conditional(L)
+
+    results = pd.DataFrame({'MI_i' : np.broadcast_to(MI_i, (ntrials,)), 
+                            'MSE_i' : np.sum((x - xhat_i)**2, axis=1),
+                            'MI' : MI, 'MSE' : np.sum((x - xhatspikes)**2, axis=1),
+                            'qon' : qon, 'qoff' : qoff})
+    xhats = {'xhat_i' : xhat_i, 'xhatspikes' : xhatspikes} if xhat else None
+    return [results, xhats]
+
+
+def _check_spikes(spikes, nt, spiketimes):
+    ''' Raises a ValueError if spikes don't look like spiketrains (or spike times with
+        spiketimes), so one is never silently analysed as the other.
+    '''
+    if spiketimes:
+        for trial in spikes:
+            trial = np.asarray(trial)
+            if len(trial) == nt and nt > 1 and np.all((trial == 0) | (trial == 1)):
+                raise ValueError('Spikes look like spiketrains of 0 and 1, not spike times')
+    else:
+        if any(np.size(trial) != nt for trial in spikes):
+            raise ValueError(f'Spiketrains must have {nt} bins, pass spiketimes=True for spike times')
+        spikes = np.asarray(spikes, dtype=float)
+        if np.any(spikes < 0) or np.any(spikes != np.rint(spikes)):
+            raise ValueError('Spiketrains must be spike counts, pass spiketimes=True for spike times')
+
+
+def bootstrap_MI(x, xhats, nboot=1000, ci=0.95, seed=None, workers=None):
+    ''' Block-bootstrap confidence intervals of MI_i and MI per trial. The complete
+        segments of the hidden state (see segment_index) are resampled with replacement 
+        and the MI is recomputed from per segment sums of the already integrated 
+        posteriors, so L is not integrated again. This is valid as long as the posterior
+        forgets the previous segment quickly (segments much longer than 1/(ron + roff)); 
+        qon and qoff are not re-estimated per resample.
+
+        INPUT:
+              x(array): hidden state (ntrials x nt), or (nt) if shared by all trials.
+              xhats(dict): xhat_i and xhatspikes (ntrials x nt) of analyze_exp_batch.
+              nboot(int): number of bootstrap resamples.
+              ci(float): confidence level of the interval.
+              seed(optional): seed of the resampling, every trial gets a child stream.
+              workers(int): number of processes, trials are divided over a process pool.
+                            1 runs in this process, None uses all cores.
+        OUTPUT:
+              intervals(DataFrame): per trial MI_i_low, MI_i_high, MI_i_std, MI_low, MI_high 
+                                    and MI_std.
+    '''
+    xhat_i = np.atleast_2d(xhats['xhat_i'])
+    xhatspikes = np.atleast_2d(xhats['xhatspikes'])
+    ntrials = len(xhatspikes)
+    x = np.broadcast_to(x, xhatspikes.shape)
+    seeds = np.random.SeedSequence(seed).spawn(ntrials)
+    jobs = [(x[n], xhat_i[n], xhatspikes[n], nboot, ci, seeds[n]) for n in range(ntrials)]
+
+    if workers == 1:
+        intervals = [_bootstrap_trial(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            intervals = list(pool.map(_bootstrap_trial, *zip(*jobs)))
+    return pd.DataFrame(intervals)
+
+
+def _bootstrap_trial(x, xhat_i, xhatspikes, nboot, ci, seed):
+    ''' Bootstrap of one trial for bootstrap_MI.
+    '''
+    # Per segment: length, time in the ON state and log-likelihood of both estimates
+    loglik = lambda p: x * np.log2(p) + (1 - x) * np.log2(1 - p)
+    sums, _ = segment_sums(x, np.stack((np.ones_like(x, dtype=float), x, loglik(xhat_i), loglik(xhatspikes))))
+    nsegments = sums.shape[1]
+    if nsegments == 0:
+        print('No complete segments; bootstrap not possible')
+        return dict.fromkeys(['MI_i_low', 'MI_i_high', 'MI_i_std', 'MI_low', 'MI_high', 'MI_std'], np.nan)
+
+    # Resample the segments: counts of every segment per resample
+    rng = np.random.default_rng(seed)
+    picked = rng.integers(nsegments, size=(nboot, nsegments)) + nsegments*np.arange(nboot)[:, None]
+    counts = np.bincount(picked.ravel(), minlength=nboot*nsegments).reshape(nboot, nsegments)
+    n, on, ll_i, ll = (counts @ sums.T).T
+
+    px = on / n
+    Hxx = - px * np.log2(px) - (1 - px) * np.log2(1 - px)
+    intervals = {}
+    for key, MI in (('MI_i', Hxx + ll_i / n), ('MI', Hxx + ll / n)):
+        low, high = np.nanpercentile(MI, [50*(1 - ci), 50*(1 + ci)])
+        intervals.update({key + '_low' : low, key + '_high' : high, key + '_std' : np.nanstd(MI)})
+    return intervals
+
+
+def save_analysis(path, results, xhats=None):
+    ''' Saves the output of analyze_exp_batch, results to path.csv and the
+        xhat arrays (if any) to path.npz.
+    '''
+    results.to_csv(path + '.csv', index=False)
+    if xhats is not None:
+        np.savez(path + '.npz', **xhats)
+
+
+def _spiketimes_to_train(spiketimes, nt, dt):
+    ''' Binary (1 x nt) spiketrain of the spike times (ms).
+    '''
+    spiketrain = np.zeros((1, nt))
+    spiketrain[0, np.clip((np.asarray(spiketimes)/dt).astype(int), 0, nt - 1)] = 1
+    return spiketrain
+
+
 def dLdt_input(L, ron, roff, I, theta):
     ''' Differential equation calculating the posterior Log-likelihood of the 
         hidden state being 1 based on the input history.
@@ -65,35 +220,203 @@ def p_conditional(L):
     return 1. / (1 + np.exp(-L))
 
 
-def MI_est(L, x):
+def MI_est(L, x, axis=None):
     ''' Calculates the mutual information (MI) based on the entorpy of the hidden state (Hxx)
         and the conditional entropy of the hidden state given the input (Hxy).
+        With axis=-1 the MI is calculated per row (trial).
         Equations 4, 6 & 8  
     '''
-    Hxx = - np.mean(x) * np.log2(np.mean(x)) - (1 - np.mean(x)) * np.log2(1 - np.mean(x))
-    Hxy = - np.mean(x * np.log2(p_conditional(L)) + (1 - x) * np.log2(1 - p_conditional(L)))
+    px = np.mean(x, axis=axis)
+    Hxx = - px * np.log2(px) - (1 - px) * np.log2(1 - px)
+    Hxy = - np.mean(x * np.log2(p_conditional(L)) + (1 - x) * np.log2(1 - p_conditional(L)), axis=axis)
     MI = Hxx - Hxy
     return Hxx, Hxy, MI
 
 
-def calc_MI_input(ron, roff, I, theta, x, dt):
+def integrate_L(I, ron, roff, theta, dt, w=1., jit=None, L0=None):
+    ''' Integrates the posterior Log-likelihood (Equation 10) with forward Euler for 
+        all trials at once, from L = log(ron/roff) or L0.
+
+        INPUT:
+              I(array): input (nt) or (ntrials x nt), a row per trial.
+              ron, roff(float): switching speed of the hidden state.
+              theta, w(float or array): offset and weight of the input, per trial or shared.
+              dt(float): time step.
+              jit(bool): use the numba compiled kernel, by default when numba is installed.
+              L0(float or array, optional): L at the first timestep, per trial or shared.
+        OUTPUT:
+              L(array): Log-likelihood with the shape of I. A trial that diverges
+                        (abs(L) > 1000) is stopped and the rest of its row is nan.
+    '''
+    I = np.asarray(I, dtype=float)
+    I2 = np.atleast_2d(I)
+    ntrials, nt = I2.shape
+    theta = np.broadcast_to(np.asarray(theta, dtype=float), (ntrials,))
+    w = np.broadcast_to(np.asarray(w, dtype=float), (ntrials,))
+    L = np.full((ntrials, nt), np.nan)
+    L[:, 0] = np.log(ron/roff) if L0 is None else L0
+    # Timestep where each trial diverges, -1 if it doesn't
+    stop = np.full(ntrials, -1)
+
+    if jit is None:
+        jit = numba is not None
+    if jit:
+        if numba is None:
+            raise ImportError('The jit kernel of integrate_L needs numba')
+        _integrate_L_jit(I2, ron, roff, theta, w, dt, L, stop)
+    elif ntrials < 16:
+        # Few trials: a scalar loop per trial is cheaper than numpy calls per timestep
+        for n in range(ntrials):
+            Ln, stop[n] = _integrate_L_row(I2[n].tolist(), L[n, 0], ron, roff, theta[n], w[n], dt)
+            L[n, :len(Ln)] = Ln
+    else:
+        # Advance all trials a timestep at a time (time major for contiguous rows), 
+        # diverged trials are cut afterwards
+        Lt = np.empty((nt, ntrials))
+        Lt[0] = L[:, 0]
+        drive = (I2.T * w - theta + ron - roff) * dt
+        eL = np.empty(ntrials)
+        with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+            for i in range(nt - 1):
+                np.exp(Lt[i], out=eL)
+                np.add(Lt[i], (ron*dt) / eL - (roff*dt) * eL + drive[i], out=Lt[i + 1])
+        L = Lt.T.copy()
+        outside = ~(np.abs(L) <= 1000)
+        for n in np.flatnonzero(outside.any(axis=1)):
+            stop[n] = np.argmax(outside[n])
+            L[n, stop[n] + 1:] = np.nan
+
+    diverged = stop >= 0
+    if diverged.any():
+        print(f'L diverges in {diverged.sum()} trial(s), weights too large')
+    return L.reshape(I.shape)
+
+
+def _integrate_L_row(I, L0, ron, roff, theta, w, dt):
+    ''' Integrates L of one trial (list of inputs) from L0 with Python floats, returns 
+        [L, stop]: the list of L up to and including the timestep stop where it 
+        diverges (-1 if it doesn't).
+    '''
+    L = [L0]
+    Ln = L0
+    for Ii in I[:-1]:
+        try:
+            Ln = Ln + (ron * (1. + math.exp(-Ln)) - roff * (1. + math.exp(Ln)) + w*Ii - theta) * dt
+        except OverflowError:
+            # exp overflows from abs(L) > 709, the next L is infinite like in the numpy path
+            Ln = -math.copysign(math.inf, Ln)
+        L.append(Ln)
+        if abs(Ln) > 1000:
+            return [L, len(L) - 1]
+    return [L, -1]
+
+
+def _integrate_L_loop(I, ron, roff, theta, w, dt, L, stop):
+    ''' Loop over trials and time of integrate_L, compiled with numba. Sets stop[n]
+        to the timestep where trial n diverges.
+    '''
+    ntrials, nt = I.shape
+    for n in range(ntrials):
+        for i in range(nt - 1):
+            L[n, i + 1] = L[n, i] + (ron * (1. + math.exp(-L[n, i])) - roff * (1. + math.exp(L[n, i])) 
+                                     + w[n]*I[n, i] - theta[n]) * dt
+            if abs(L[n, i + 1]) > 1000:
+                stop[n] = i + 1
+                break
+
+
+_integrate_L_jit = numba.njit(cache=True)(_integrate_L_loop) if numba is not None else None
+
+
+class OnlineMI:
+    ''' Streaming version of calc_MI_input (and of calc_MI_ideal with known qon, qoff) 
+        that consumes consecutive chunks of the hidden state and input in constant memory. 
+        L is carried over between chunks and Hxx and Hxy are kept as running sums, 
+        so the MI is available after every chunk and equal to the MI of the whole
+        recording at the end.
+
+        INPUT:
+              ron, roff(float): switching speed of the hidden state.
+              dt(float): time step.
+              theta, w(float or array): offset and weight of the input, per trial or shared.
+                                        For a spike train the input is spiketrain/dt with 
+                                        w = log(qon/qoff) and theta = qon - qoff.
+              jit(bool): see integrate_L.
+
+        Chunks can be (nt) or (ntrials x nt) to follow several trials at once.
+    '''
+    def __init__(self, ron, roff, dt, theta=0., w=1., jit=None):
+        self.ron = ron
+        self.roff = roff
+        self.dt = dt
+        self.theta = theta
+        self.w = w
+        self.jit = jit
+        self.L = None           # L at the first timestep of the next chunk
+        self.n = 0              # Number of timesteps
+        self.on = 0.            # Timesteps in the ON state
+        self.loglik = 0.        # Sum of x log2(p) + (1 - x) log2(1 - p)
+        self.history = []       # [n, MI] after every chunk
+
+    def update(self, x, I):
+        ''' Adds the next chunk of the hidden state x and input I, returns the MI so far.
+        '''
+        x = np.asarray(x)
+        I = np.asarray(I, dtype=float)
+        L = integrate_L(I, self.ron, self.roff, self.theta, self.dt, w=self.w, jit=self.jit, L0=self.L)
+
+        # Step past the last timestep of the chunk
+        L_last = L[..., -1]
+        with np.errstate(over='ignore', invalid='ignore'):
+            self.L = L_last + (self.ron * (1. + np.exp(-L_last)) - self.roff * (1. + np.exp(L_last)) 
+                               + self.w*I[..., -1] - self.theta) * self.dt
+
+        # Running sums
+        p = p_conditional(L)
+        self.n += np.shape(x)[-1]
+        self.on = self.on + np.sum(x, axis=-1)
+        self.loglik = self.loglik + np.sum(x * np.log2(p) + (1 - x) * np.log2(1 - p), axis=-1)
+        MI = self.MI
+        self.history.append([self.n, MI])
+        return MI
+
+    @property
+    def Hxx(self):
+        px = self.on / self.n
+        return - px * np.log2(px) - (1 - px) * np.log2(1 - px)
+
+    @property
+    def Hxy(self):
+        return - self.loglik / self.n
+
+    @property
+    def MI(self):
+        return self.Hxx - self.Hxy
+
+    def converged(self, tol, nchunks=5):
+        ''' True when the MI changed less than tol over the last nchunks chunks 
+            (for all trials), so a run can be stopped early.
+        '''
+        if len(self.history) <= nchunks:
+            return False
+        recent = np.array([MI for _, MI in self.history[-nchunks-1:]])
+        return bool(np.all(np.ptp(recent, axis=0) < tol))
+
+
+def calc_MI_input(ron, roff, I, theta, x, dt, jit=None):
     ''' Calculate the mutual information between hidden state x and
         generater input train (same size vector) assuming a ideal observer
         that knows ron, roff and theta.
+        I and x can be (ntrials x nt) to analyse all trials at once, 
+        Hxx, Hxy and MI are then per trial.
         Note that if dt in ms, then ron and roff in kHz.
         Note that information is calculated in bits. For nats use log instead of log2.
     '''
     # Integrate the posterior Log-likelihood
-    L = np.empty(len(x))
-    L[0] = np.log(ron/roff)
-    for i in range(len(x) - 1):
-        L[i + 1] = L[i] + dLdt_input(L[i], ron, roff, I[i], theta) * dt
-        if abs(L[i+1]) > 1000:
-            print('L diverges weights too large')
-            break
+    L = integrate_L(I, ron, roff, theta, dt, jit=jit)
 
     # Calculate the Mutual Information
-    Hxx, Hxy, MI = MI_est(L, x)
+    Hxx, Hxy, MI = MI_est(L, x, axis=-1)
     return [Hxx, Hxy, MI, L]
 
 
@@ -101,143 +424,152 @@ def calc_MI_ideal(ron, roff, spiketrain, x, dt):
     ''' Calculate the (conditional) entropy, MI, and likelihood.
     '''
     ## Calculate qon, qoff, w and theta
-    spikesup, spikesdown = reorder_x(x, spiketrain)
-    spikesup = np.squeeze(spikesup)
-    spikesdown = np.squeeze(spikesdown)
-
-    nspikesup = abs(np.nansum(np.nansum(spikesup)))
-    nspikesdown = abs(np.nansum(np.nansum(spikesdown)))
-    if nspikesdown == 0:
-        print('no down spikes, inventing one')
-        nspikesdown = 1 
-
-    qon = nspikesup / (sum(x)*dt)
-    qoff = nspikesdown / ((len(x) - sum(x))*dt)
+    qon, qoff = spike_rates(spiketrain, x, dt)
     w = np.log(qon/qoff)
     theta = qon-qoff
     # print('w=', w, '; theta=', theta)
 
     ## Integrate L
-    I = spiketrain/dt
-    L = np.empty(np.shape(x))
-    L[0] = np.log(ron/roff)
-
-    for nn in range(len(x) - 1):
-        L[nn+1] = L[nn] + dLdt_spikes(L[nn], ron, roff, I[0][nn], w, theta) * dt
-        if abs(L[nn+1]) > 1000:
-            assert StopIteration('L diverges, weights too large')
+    I = np.reshape(spiketrain, np.shape(x))/dt
+    L = integrate_L(I, ron, roff, theta, dt, w=w)
     
     # Calculate MI
     Hxx, Hxy, MI = MI_est(L, x)
     return Hxx, Hxy, MI, L, qon, qoff
 
 
+def calc_MI_ideal_events(ron, roff, spiketimes, x, dt):
+    ''' Event-driven version of calc_MI_ideal that takes the spike times (ms) instead
+        of a spiketrain. L is advanced exactly from spike to spike (see integrate_L_events)
+        and only evaluated on the time grid of x, so the cost scales with the number 
+        of spikes instead of with a Python step per dt.
+    '''
+    ## Calculate qon, qoff, w and theta
+    spiketimes = np.sort(np.asarray(spiketimes, dtype=float).flatten())
+    qon, qoff = spike_rates(_spiketimes_to_train(spiketimes, len(x), dt), x, dt)
+    w = np.log(qon/qoff)
+    theta = qon-qoff
+
+    ## Evaluate L on the grid
+    L = integrate_L_events(spiketimes, ron, roff, theta, w, np.arange(len(x))*dt)
+
+    # Calculate MI
+    Hxx, Hxy, MI = MI_est(L, x)
+    return Hxx, Hxy, MI, L, qon, qoff
+
+
+def integrate_L_events(spiketimes, ron, roff, theta, w, t):
+    ''' Exact posterior Log-likelihood of a spike train evaluated at times t, from 
+        L = log(ron/roff) at t=0. Between spikes dL/dt = ron(1 + exp(-L)) - roff(1 + exp(L)) - theta, 
+        with u = exp(L) this is du/dt = -roff(u - u1)(u - u2), which has the closed form
+        (u - u1)/(u - u2) = K exp(-roff(u1 - u2)t). At every spike L jumps with w, 
+        a spike at time s is seen at all t > s.
+
+        INPUT:
+              spiketimes(array): sorted spike times in ms.
+              ron, roff(float): switching speed of the hidden state in kHz.
+              theta, w(float): offset and weight of the spike train.
+              t(array): times in ms to evaluate L at.
+        OUTPUT:
+              L(array): Log-likelihood at t.
+    '''
+    # Fixed points of u
+    b = ron - roff - theta
+    root = np.sqrt(b**2 + 4*ron*roff)
+    u1, u2 = (b + root)/(2*roff), (b - root)/(2*roff)
+
+    def K(L):
+        # (u - u1)/(u - u2) without overflow of exp(L)
+        with np.errstate(over='ignore'):
+            return np.where(L > 0, (1 - u1*np.exp(-np.abs(L)))/(1 - u2*np.exp(-np.abs(L))),
+                                   (np.exp(-np.abs(L)) - u1)/(np.exp(-np.abs(L)) - u2))
+
+    def advance(L, elapsed):
+        KE = K(L) * np.exp(-root*elapsed)
+        return np.log(u1 - u2*KE) - np.log1p(-KE)
+
+    # L just after each spike, spike to spike
+    t_last = np.concatenate(([0.], spiketimes))
+    L_last = np.empty(len(t_last))
+    L_last[0] = np.log(ron/roff)
+    for k in range(len(spiketimes)):
+        L_last[k + 1] = advance(L_last[k], t_last[k + 1] - t_last[k]) + w
+
+    # Evaluate from the last spike before every t
+    idx = np.searchsorted(spiketimes, t, side='left')
+    return advance(L_last[idx], t - t_last[idx])
+
+
+def spike_rates(spiketrain, x, dt):
+    ''' Estimates the firing rates qon and qoff of the spiketrain during the
+        ON and OFF state of the hidden state x, from the spikes in the complete
+        segments of x (see segment_index).
+    '''
+    sums, values = segment_sums(x, spiketrain)
+    nspikesup = abs(np.nansum(sums[:, values == 1]))
+    nspikesdown = abs(np.nansum(sums[:, values == 0]))
+    if nspikesdown == 0:
+        print('no down spikes, inventing one')
+        nspikesdown = 1 
+
+    qon = nspikesup / (np.sum(x)*dt)
+    qoff = nspikesdown / ((len(x) - np.sum(x))*dt)
+    return qon, qoff
+
+
+def segment_index(x):
+    ''' Run-length encoding of the hidden state x, the segments between two jumps.
+        The first and last segment are cut off by the recording and left out.
+
+        OUTPUT:
+              [starts, stops, values]: start (inclusive) and stop (exclusive) index 
+                                       and value of x of every complete segment.
+    '''
+    x = np.asarray(x).flatten()
+    jumps = np.flatnonzero(x[1:] != x[:-1]) + 1
+    return [jumps[:-1], jumps[1:], x[jumps[:-1]]]
+
+
+def segment_sums(x, ordervecs):
+    ''' Sums of the vectors in ordervecs (nvec x length) over every complete segment 
+        of x, e.g. the spike counts per segment, in one pass.
+
+        OUTPUT:
+              [sums, values]: (nvec x nsegments) sums and the value of x per segment.
+    '''
+    ordervecs = _check_ordervecs(x, ordervecs)
+    starts, stops, values = segment_index(x)
+    if len(starts) == 0:
+        return [np.zeros((len(ordervecs), 0)), values]
+    sums = np.add.reduceat(ordervecs[:, :stops[-1]], starts, axis=1)
+    return [sums, values]
+
+
 def reorder_x(x, ordervecs):
     ''' Reorder the vectors in ordervec (nvec * length) to x=1 (up) 
         and x=0 (down)
+
+        OUTPUT:
+              [revecsup, revecsdown]: lists with a (nvec x segment length) view into 
+                                      ordervecs per complete up and down segment
+                                      (see segment_index).
     '''
-    ## Check if transposing is necessary
-    # Check ordervecs
-    number_of_vectors, timesteps = np.shape(ordervecs)
-    if number_of_vectors > timesteps:
-        s = input('Number of vectors larger than number of timesteps; transpose? (y/n')
-        if s == 'y':
-            ordervecs = np.transpose(ordervecs)
-            number_of_vectors, timesteps = np.shape(ordervecs)
-    
-    # Check hiddenstate
-    number_of_xvectors, _ = np.shape([x])
-    if number_of_xvectors != 1:
-        x = np.transpose(x)
-    
-    ## TODO what does this piece of code do?
-    xt1 = np.insert(x, 0, x[0])
-    xt2 = np.append(x, x[-1])
-    xj = xt2 - xt1 # This is equal to xj[n] = x[n] - x[n-1]
-    njumpup = len(xj[xj==1])
-    njumpdown = len(xj[xj==-1])
-
-    ## Reorder
-    if njumpup > 0 and njumpdown > 0:
-        firstjump = np.argwhere(abs(xj) == 1).flatten()
-        firstjump = firstjump[0]
-        revecsup = np.nan * np.empty((number_of_vectors, njumpup+1, round(10*timesteps/njumpup)))
-        revecsdown = np.nan * np.empty((number_of_vectors, njumpdown+1, round(10*timesteps/njumpdown)))
-        _, _, size3 = np.shape(revecsdown)
-
-        if x[firstjump] == 1:
-            up = 1
-            down = 0
-            revecsup[:, 0, 0] = ordervecs[:, firstjump]
-        elif x[firstjump] == 0:
-            up = 0
-            down = 1
-            revecsdown[:, 0, 0] = ordervecs[:, firstjump]
-        else:
-            raise AssertionError('First jump is not properly defined')
-
-        tt = 1
-        tmaxup = 1
-        tmaxdown = 1
-
-        for nn in range(firstjump+1, timesteps):
-            try:
-                jump = x[nn] - x[nn-1]
-            except:
-                raise AssertionError('size ordervecs not the same as size x')
-            
-            # Make jumps
-            if jump == 0:
-                tt = tt + 1
-                
-                if x[nn] == 1:
-                    # Up state
-                    if tt > tmaxup:
-                        tmaxup = tt
-                    revecsup[:, up, tt] = ordervecs[:, nn]
-                elif x[nn] == 0:
-                    # Down state
-                    if tt > tmaxdown:
-                        tmaxdown = tt
-                    revecsdown[:, down, tt] = ordervecs[:, nn]
-                else:
-                    raise AssertionError('Something went wrong: x not 0 or 1')
-            
-            elif jump == 1:
-                #Jump up
-                tt = 1
-                up = up + 1
-                if x[nn] == 1:
-                    revecsup[:, up, tt] = ordervecs[:, nn]
-                else:
-                    raise AssertionError('Something went wrong: jump up but x not 1')
-
-            elif jump == -1:
-                # Jump down
-                tt = 1
-                down = down + 1
-                if x[nn] == 0:
-                    revecsdown[:, down, tt] = ordervecs[:, nn]
-                else:
-                    raise AssertionError('Something went wrong: jump down but x is not 0')
-            
-            else:
-                raise AssertionError('Something went wrong: no jump up or down')
-        
-            if tt > size3 - 1:
-                # tt will run out of Matrix size
-                raise IndexError('Choose larger starting Matrix')
-
-        revecsup = revecsup[:, 1:up, 1:tmaxup] 
-        revecsdown = revecsdown[:, 1:down, 1:tmaxdown]
-    
-    else:
-        if njumpup < 1:
-            print('No jumps up; reordering not possible')
-            revecsup = None
-            revecsdown = None
-        if njumpsdown < 1:
-            print('No jumps down; reordering not possible')
-            revecsup = None
-            revecsdown = None
-    return revecsup, revecsdown
\ No newline at end of file
+    ordervecs = _check_ordervecs(x, ordervecs)
+    starts, stops, values = segment_index(x)
+    if len(starts) == 0:
+        print('No complete up and down segments; reordering not possible')
+
+    revecsup = [ordervecs[:, start:stop] for start, stop in zip(starts[values == 1], stops[values == 1])]
+    revecsdown = [ordervecs[:, start:stop] for start, stop in zip(starts[values == 0], stops[values == 0])]
+    return revecsup, revecsdown
+
+
+def _check_ordervecs(x, ordervecs):
+    ''' Returns ordervecs as (nvec x length) with the length of x, transposed if needed.
+    '''
+    ordervecs = np.atleast_2d(ordervecs)
+    if np.shape(ordervecs)[1] != np.size(x) and np.shape(ordervecs)[0] == np.size(x):
+        ordervecs = ordervecs.T
+    if np.shape(ordervecs)[1] != np.size(x):
+        raise ValueError('Size of ordervecs not the same as size of x')
+    return ordervecs
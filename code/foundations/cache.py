@@ -0,0 +1,113 @@
+'''
+    cache.py
+
+    On-disk cache of generated experiments, keyed by a hash of all parameters and the seed,
+    so repeated sweeps and plotting sessions only pay the generation cost once.
+    Entries are stored as .npy files (the conductances as float64, the hidden state as int8),
+    loaded memory-mapped and evicted least recently used first when the cache grows larger
+    than max_size.
+'''
+import os,sys,inspect
+current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+import hashlib
+import json
+import numpy as np
+from foundations.make_dynamic_experiments import make_dynamic_experiments, to_precision
+
+CACHE_DIR = os.path.join(os.path.dirname(parent_dir), 'results', 'cache')
+CACHE_VERSION = 2
+
+def cached_dynamic_experiments(*args, cache_dir=CACHE_DIR, max_size=2**30, **kwargs):
+    ''' make_dynamic_experiments with an on-disk cache. Takes the same arguments and
+        returns the same [input_theory, (g_exc, g_inh), hidden_state], as read-only
+        memory-mapped arrays, the hidden state as int8. Without a seed the experiment can't
+        be reproduced, so it is generated without the cache. The cache stores float64,
+        other precisions are converted after loading.
+
+        INPUT:
+            See make_dynamic_experiments.
+            cache_dir (str): directory of the cache.
+            max_size (int): maximum size of the cache in bytes.
+    '''
+    bound = inspect.signature(make_dynamic_experiments).bind(*args, **kwargs)
+    bound.apply_defaults()
+    if bound.arguments['seed'] is None:
+        return make_dynamic_experiments(*args, **kwargs)
+    precision = bound.arguments.pop('precision')
+
+    # Load from cache, the 0/1 hidden state is stored next to the entry as int8
+    path = os.path.join(cache_dir, get_cache_key('make_dynamic_experiments', bound.arguments) + '.npy')
+    if not (os.path.exists(path) and os.path.exists(state_path(path))):
+        input_theory, (g_exc, g_inh), hidden_state = make_dynamic_experiments(**bound.arguments)
+        save_to_cache(path, np.stack((input_theory, g_exc, g_inh)), max_size,
+                      hidden_state=np.asarray(hidden_state, dtype=np.int8))
+    os.utime(path)
+    input_theory, g_exc, g_inh = np.load(path, mmap_mode='r')
+    hidden_state = np.load(state_path(path), mmap_mode='r')
+
+    if precision != 'float64':
+        g_exc, g_inh = to_precision(g_exc, precision), to_precision(g_inh, precision)
+    return [input_theory, (g_exc, g_inh), hidden_state]
+
+
+def get_cache_key(name, arguments):
+    ''' Creates the cache key, a sha256 hash of the function name, cache version
+        and all (json serialisable) arguments.
+    '''
+    def serialise(value):
+        if isinstance(value, np.random.SeedSequence):
+            return {'entropy' : value.entropy, 'spawn_key' : value.spawn_key}
+        if isinstance(value, np.generic):
+            return value.item()
+        raise TypeError(f'Can\'t make a cache key of {type(value)}')
+
+    description = json.dumps({'name' : name, 'version' : CACHE_VERSION, 'arguments' : arguments},
+                             sort_keys=True, default=serialise)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def state_path(path):
+    ''' Path of the hidden state stored next to the cache entry at path.
+    '''
+    return path[:-len('.npy')] + '.state.npy'
+
+
+def save_to_cache(path, array, max_size, hidden_state=None):
+    ''' Saves array (and the hidden state next to it) to path, atomically so a crash never
+        leaves a half written entry, and evicts the least recently used entries until
+        the cache fits max_size.
+    '''
+    cache_dir = os.path.dirname(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    files = [(path, array)] if hidden_state is None else [(state_path(path), hidden_state), (path, array)]
+    for file_path, data in files:
+        tmp_path = file_path + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, data)
+        os.replace(tmp_path, file_path)
+
+    # Evict least recently used, an entry and its hidden state together
+    entries = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir)
+               if f.endswith('.npy') and not f.endswith('.state.npy')]
+    entries.sort(key=os.path.getmtime)
+    entry_size = lambda entry: sum(os.path.getsize(f) for f in (entry, state_path(entry)) if os.path.exists(f))
+    size = sum(entry_size(entry) for entry in entries)
+    for entry in entries:
+        if size <= max_size or entry == path:
+            break
+        size -= entry_size(entry)
+        for f in (entry, state_path(entry)):
+            if os.path.exists(f):
+                os.remove(f)
+
+
+def clear_experiment_cache(cache_dir=CACHE_DIR):
+    ''' Removes all entries from the cache.
+    '''
+    if os.path.isdir(cache_dir):
+        for f in os.listdir(cache_dir):
+            if f.endswith('.npy'):
+                os.remove(os.path.join(cache_dir, f))
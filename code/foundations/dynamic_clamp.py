@@ -3,106 +3,357 @@
 
     File containing the functions used in make_dynamic_experiments and main(dynamic).
 '''
+import struct
 import numpy as np
 import matplotlib.pyplot as plt
+from scipy import signal
 from foundations.input import Input
 
 def get_g0(v_rest, weights, Er_exc, Er_inh):
-    ''' Creates a dictionary containing the 'base' conductance of each neuron
-        in the ANN. Neuron index is used as dictionary key. 
+    ''' Creates an array containing the 'base' conductance of each neuron
+        in the ANN and masks of the excitatory and inhibitory neurons. 
 
         INPUT:
               v_rest(int): resting membrane potential of the neurons in mV.
-              weights(array): weights of each ANN neuron.
+              weights(array): weights of each ANN neuron, (N) or (ntrials x N).
               Er_exc/inh(int): reversal potential of exc. and inh. neurons in mV.
         OUTPUT: 
-              [g0_exc_dict, g0_inh_dict]: dictionaries of 'base' conductances with 
-                                          neuron index as key.
+              [g0, exc, inh]: array of 'base' conductances with the shape of weights
+                              and boolean masks of the exc. and inh. neurons, so
+                              g0 * exc are the excitatory conductances.
 
         Base conductance: value where g0 * (Vrest - Er) = weight.
         The reversal potential (Er) is based on A. Destexhe, M. Rudolph, J.M. Fellous 
         & T.J. Sejnowski (2001). 
     '''
-    N = len(weights)
-
-    #Initiate dictionaries
-    g0_exc_dict = {}
-    g0_inh_dict = {}
+    weights = np.asarray(weights, dtype=float)
 
     #Get g0 and seperate in to inhibitory and excitatory conductance
-    for i in range(N):
-        if weights[i] > 0:
-            g0 = float(weights[i] / (v_rest - Er_exc))
-            g0_exc_dict[i] = g0
-        else: 
-            g0 = float(weights[i] / (v_rest - Er_inh))
-            g0_inh_dict[i] = g0
+    exc = weights > 0
+    inh = ~exc
+    g0 = weights / np.where(exc, v_rest - Er_exc, v_rest - Er_inh)
 
     # # Sanitycheck weights equal I_inj when Vm = Vrest        
     # plt.hist(weights, bins=100, label='Weight', color='gold')
-    # g0_exc = np.array(list(g0_exc_dict.values()))
-    # plt.hist(g0_exc*(v_rest - Er_exc), bins=50, label='I_Exc', color='red', alpha=0.75)
-    # g0_inh = np.array(list(g0_inh_dict.values())) 
-    # plt.hist(g0_inh*(v_rest - Er_inh), bins=50, label='I_Inh', color='blue', alpha=0.75)
+    # plt.hist(g0[exc]*(v_rest - Er_exc), bins=50, label='I_Exc', color='red', alpha=0.75)
+    # plt.hist(g0[inh]*(v_rest - Er_inh), bins=50, label='I_Inh', color='blue', alpha=0.75)
     # plt.xlabel('Weight or I_syn')
     # plt.ylabel('freq')
     # plt.legend()
     # plt.show()
 
-    return [g0_exc_dict, g0_inh_dict]
+    return [g0, exc, inh]
 
 
-def get_stochastic_conductance(g0_dict, tau, sigma, T, dt):
+def get_stochastic_conductance(g0, tau, sigma, T, dt, rng=None, aggregate=False):
     ''' Generate conductance over time as a stochastic process.  
 
         INPUT:
-              g0_dict(dict): base conductance of neurons with index as key.
+              g0(dict or array): base conductance of neurons with index as key.
               tau(float): time constant
               sigma(float): standard deviation of the conductance.
               T(int): total duration.
               dt(float): time step.
+              rng(optional): numpy Generator or seed for one.
+              aggregate(bool): only return the summed conductance of all neurons.
         OUTPUT:
-              sto_cond(dict): dictionary of stochasticconductances with index as key.
+              sto_cond(array): (N x nt) stochastic conductances with the neuron index as
+                               row, or the (nt) summed conductance if aggregate.
 
         D, A and update rule are based on A. Destexhe, M. Rudolph, J.M. Fellous 
-        & T.J. Sejnowski (2001). 
+        & T.J. Sejnowski (2001). The exact update is applied to all neurons at once 
+        as a first order recursive filter over the noise. The sum of N independent 
+        processes with the same tau is again such a process, with amplitude A*sqrt(N),
+        so the aggregate is generated directly.
     '''
-    N = len(g0_dict)
+    rng = np.random.default_rng(rng)
+    if isinstance(g0, dict):
+        g0 = np.array([g0[i] for i in range(len(g0))])
+    g0 = np.asarray(g0, dtype=float).flatten()
+    nt = len(np.arange(0, T, dt)) + 1
     D = 2 * sigma**2 / tau                                  #Noise 'diffusion' coefficient
     A = np.sqrt(D * tau / 2 * (1 - np.exp(-2 * dt / tau) )) #Amplitude coefficient
+
+    if aggregate:
+        A = A * np.sqrt(len(g0))
+        g0 = np.array([g0.sum()])
     
-    #Initiate dictionary
-    sto_cond = {}
-    for i in range(N):
-        g0 = g0_dict[i]
-        sto_cond[i] = {}
-        sto_cond[i][0] = g0
-
-        #Update dict following an exact update rule
-        for t in np.arange(0, T, dt).round(3):
-            tdt = round(t + dt, 3)
-            sto_cond[i][tdt] = g0 + (sto_cond[i][t] - g0) * np.exp(-dt / tau) + A * np.random.normal()
-        
-        #Un-nest dict with index as key and a list of conductances
-        sto_cond[i] = np.fromiter(sto_cond[i].values(), dtype=float)
-    
+    #Exact update rule: (g[t+dt] - g0) = (g[t] - g0) * exp(-dt/tau) + A * N(0, 1), with g[0] = g0
+    noise = A * rng.standard_normal((len(g0), nt - 1))
+    sto_cond = np.empty((len(g0), nt))
+    sto_cond[:, 0] = 0
+    sto_cond[:, 1:] = signal.lfilter([1.], [1., -np.exp(-dt / tau)], noise, axis=1)
+    sto_cond += g0[:, np.newaxis]
+
+    if aggregate:
+        return sto_cond[0]
     return sto_cond 
 
 
-def get_input_LUT(sto_cond, dv, Er):
+def get_input_LUT(sto_cond, dv, Er, precision='float64'):
     ''' Create a look-up table (LUT) of injected currents based on conductance(t) 
         and the voltages from -100 to +20 mV.
 
+        The current is I(t) = g(t) * (v - Er), the sign convention of the models
+        (e.g. Barrel_PC) and of playback. The dictionary this function used to return
+        held g(t) * (-v - Er), so the sign and value of the current differ from it.
+
         INPUT:
-              sto_cond(array): dictionary of individual conductances over time.
+              sto_cond(array): conductance over time.
               dv(int): resolution of the voltage steps minimal 0.001.
               Er(int): inhibitory or excitatory conductances?
+              precision(str): storage of the table, 'float64', 'float32' or 'int16'.
         OUTPUT:
-              input_LUT(dict): keys are the voltage and value the I(t). 
+              input_LUT(InputLUT): LUT with the voltage as key and I(t) as value. 
     '''  
-    volt_vec = np.arange(-100, 20+dv, dv).round(3)
-    input_LUT = {}
-    for v in volt_vec:
-        input_LUT[v] = sto_cond * (-v - Er)
+    return InputLUT(sto_cond, dv, Er, precision=precision)
+
+
+def quantize(array, precision, value_range=None):
+    ''' Converts array to a compact precision. 'float64' and 'float32' are casts,
+        'int16' maps the range of the array linearly onto the int16 range with
+        array = data * scale + offset.
+
+        INPUT:
+              value_range(tuple, optional): (min, max) to map onto the int16 range instead
+                                            of the range of array, to convert a large array
+                                            in blocks with one scale and offset.
+        OUTPUT:
+              [data, scale, offset]: converted array and its scale and offset.
+    '''
+    array = np.asarray(array, dtype=float)
+    if precision in ('float64', 'float32'):
+        return [array.astype(precision), 1., 0.]
+    elif precision == 'int16':
+        if value_range is not None:
+            lo, hi = value_range
+        else:
+            lo, hi = (array.min(), array.max()) if array.size else (0., 0.)
+        offset = (hi + lo) / 2
+        scale = (hi - lo) / (2 * np.iinfo(np.int16).max) if hi > lo else 1.
+        return [np.rint((array - offset) / scale).astype(np.int16), scale, offset]
+    else:
+        raise ValueError('Precision must be \'float64\', \'float32\' or \'int16\'')
+
+
+def dequantize(data, scale, offset):
+    ''' Converts data from quantize back to float64.
+    '''
+    return np.asarray(data, dtype=float) * scale + offset
+
+
+def precision_error(array, resolution=None, value_range=None):
+    ''' Reports the error of every precision of quantize against the float64 reference,
+        to pick the cheapest format within the amplifier resolution.
+
+        INPUT:
+              array(array): float64 reference, e.g. a conductance trace or LUT table.
+              resolution(float, optional): resolution of the amplifier in the unit of array.
+              value_range(tuple, optional): int16 range, see quantize.
+        OUTPUT:
+              report(dict): per precision the max and rms absolute error, the number
+                            of bytes and whether the max error is within resolution.
+    '''
+    array = np.asarray(array, dtype=float)
+    report = {}
+    for precision in ('float64', 'float32', 'int16'):
+        data, scale, offset = quantize(array, precision, value_range)
+        error = np.abs(dequantize(data, scale, offset) - array)
+        report[precision] = {'max_error' : error.max() if error.size else 0., 
+                             'rms_error' : np.sqrt(np.mean(error**2)) if error.size else 0.,
+                             'bytes' : data.nbytes}
+        if resolution is not None:
+            report[precision]['within_resolution'] = report[precision]['max_error'] <= resolution
+    return report
+
+
+class InputLUT:
+    ''' Look-up table (LUT) of injected currents I(t) = g(t) * (v - Er) for the
+        voltages from vmin to vmax mV, backed by one contiguous (nv x nt) table.
+        The sign is that of the models (e.g. Barrel_PC), not the g(t) * (-v - Er)
+        of the dictionary get_input_LUT used to return.
+        The table is computed lazily as an outer product (in blocks of rows, so a compact
+        precision never needs the float64 table in memory), or memory-mapped from a
+        binary file (see save and load) so rigs and analysis code can share it 
+        without loading or copying it. Indexing with a voltage (lut[v]) works like 
+        the dictionary that get_input_LUT used to return.
+
+        INPUT:
+              sto_cond(array): conductance over time.
+              dv(float): resolution of the voltage steps minimal 0.001.
+              Er(float): reversal potential in mV.
+              vmin, vmax(float): voltage range in mV, vmax is rounded up to a whole
+                                 number of steps from vmin.
+              precision(str): storage of the table, 'float64', 'float32' or 'int16'.
+              nv(int, optional): number of voltages, instead of vmax.
+    '''
+    MAGIC = b'DCLUT\x00'
+    VERSION = 1
+    HEADER = struct.Struct('<6sH8sqqddddd')
+    HEADER_SIZE = 128
+
+    BLOCK_SIZE = 2**23  # float64 values per block of rows (64 MB)
+
+    def __init__(self, sto_cond, dv, Er, vmin=-100, vmax=20, precision='float64', nv=None):
+        self.conductance = None if sto_cond is None else np.asarray(sto_cond, dtype=float).flatten()
+        self.dv = dv
+        self.Er = Er
+        # Voltages as vmin + i*dv, so their number always matches the rows of the table
+        if nv is None:
+            nv = int(np.ceil((vmax - vmin)/dv - 1e-9)) + 1
+        self.volt_vec = (vmin + np.arange(nv)*dv).round(3)
+        self.precision = precision
+        self.scale = 1.
+        self.offset = 0.
+        self._table = None
+
+    @property
+    def table(self):
+        ''' The stored (nv x nt) table, row i is the current at volt_vec[i] 
+            as data * scale + offset.
+        '''
+        if self._table is None:
+            table = np.empty(self.shape, dtype=np.dtype(self.precision))
+            for start, stop, block in self._blocks():
+                table[start:stop] = block
+            self._table = table
+        return self._table
+
+    def value_range(self):
+        ''' Minimum and maximum current of the table, without computing it: the
+            extremes of an outer product are products of the extremes of its vectors.
+        '''
+        if self.conductance.size == 0:
+            return (0., 0.)
+        corners = np.outer(self.volt_vec[[0, -1]] - self.Er,
+                           [self.conductance.min(), self.conductance.max()])
+        return (corners.min(), corners.max())
+
+    def _rows(self):
+        ''' (start, stop) of the blocks of rows of BLOCK_SIZE values.
+        '''
+        nv, nt = self.shape
+        step = max(1, self.BLOCK_SIZE // max(nt, 1))
+        return [(start, min(start + step, nv)) for start in range(0, nv, step)]
+
+    def _blocks(self, precision=None):
+        ''' Yields (start, stop, block) with the rows start:stop of the table in precision
+            (default the precision of the LUT) and sets the scale and offset. The float64
+            rows are computed per block, a stored table is read per block.
+        '''
+        if self._table is not None and precision is None:
+            for start, stop in self._rows():
+                yield start, stop, self._table[start:stop]
+            return
+        precision = self.precision if precision is None else precision
+        value_range = self.value_range()
+        for start, stop in self._rows():
+            block = np.outer(self.volt_vec[start:stop] - self.Er, self.conductance)
+            data, scale, offset = quantize(block, precision, value_range)
+            if precision == self.precision:
+                self.scale, self.offset = scale, offset
+            yield start, stop, data
+
+    def precision_error(self, resolution=None):
+        ''' Error report of all precisions against the float64 table, see precision_error.
+            Computed per block of rows, so it never needs the whole float64 table.
+        '''
+        if self.conductance is None:
+            raise ValueError('Precision error needs the conductance, not a loaded LUT')
+        value_range = self.value_range()
+        nt = self.shape[1]
+        blocks = [((stop - start)*nt, precision_error(np.outer(self.volt_vec[start:stop] - self.Er, self.conductance),
+                                                      value_range=value_range)) for start, stop in self._rows()]
+        size = sum(n for n, _ in blocks)
+        report = {}
+        for precision in blocks[0][1]:
+            max_error = max(block[precision]['max_error'] for _, block in blocks)
+            sum_error = sum(n * block[precision]['rms_error']**2 for n, block in blocks)
+            report[precision] = {'max_error' : max_error,
+                                 'rms_error' : np.sqrt(sum_error / size) if size else 0.,
+                                 'bytes' : sum(block[precision]['bytes'] for _, block in blocks)}
+            if resolution is not None:
+                report[precision]['within_resolution'] = max_error <= resolution
+        return report
+
+    @property
+    def shape(self):
+        return (len(self.volt_vec), np.shape(self._table)[1] if self.conductance is None else len(self.conductance))
+
+    def index(self, v):
+        ''' Row index of the (vector of) voltage(s) v, rounded to the nearest 
+            voltage step and clipped to the voltage range.
+        '''
+        idx = np.rint((np.asarray(v) - self.volt_vec[0]) / self.dv).astype(int)
+        return np.clip(idx, 0, len(self.volt_vec) - 1)
+
+    def lookup(self, v_trace, t_idx=None):
+        ''' Vectorised lookup of the current for a whole voltage trace, v_trace[i]
+            at time index t_idx[i] (default 0, 1, 2, ...). Without a computed table 
+            only the requested entries are calculated.
+        '''
+        v_idx = self.index(v_trace)
+        if t_idx is None:
+            t_idx = np.arange(np.size(v_idx))
+        if self._table is None and self.precision == 'float64':
+            return self.conductance[t_idx] * (self.volt_vec[v_idx] - self.Er)
+        return dequantize(self.table[v_idx, t_idx], self.scale, self.offset)
+
+    def save(self, path):
+        ''' Saves the table to a binary file: a 128 byte header (magic, version, dtype,
+            shape, first voltage, dv, Er, scale and offset) followed by the contiguous table.
+            A table that isn't computed yet is written a block of rows at a time.
+        '''
+        with open(path, 'wb') as f:
+            f.seek(self.HEADER_SIZE)
+            for _, _, block in self._blocks():
+                np.ascontiguousarray(block).tofile(f)
+            # The scale and offset are known after the first block
+            header = self.HEADER.pack(self.MAGIC, self.VERSION, np.dtype(self.precision).str.encode(),
+                                 *self.shape, self.volt_vec[0], self.dv, self.Er, self.scale, self.offset)
+            f.seek(0)
+            f.write(header.ljust(self.HEADER_SIZE, b'\x00'))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        ''' Loads a LUT saved with save, memory-mapped (read-only) by default.
+        '''
+        with open(path, 'rb') as f:
+            header = f.read(cls.HEADER_SIZE)
+        if len(header) < cls.HEADER.size or header[:len(cls.MAGIC)] != cls.MAGIC:
+            raise ValueError(f'{path} is not a LUT file')
+        _, version, dtype, nv, nt, vmin, dv, Er, scale, offset = cls.HEADER.unpack_from(header)
+        if version != cls.VERSION:
+            raise ValueError(f'{path} is a LUT file of version {version}, not {cls.VERSION}')
+
+        dtype = np.dtype(dtype.rstrip(b'\x00').decode())
+        lut = cls(None, dv, Er, vmin, precision=dtype.name, nv=nv)
+        lut.scale = scale
+        lut.offset = offset
+        if mmap:
+            lut._table = np.memmap(path, dtype=dtype, mode='r', offset=cls.HEADER_SIZE, shape=(nv, nt))
+        else:
+            lut._table = np.fromfile(path, dtype=dtype, offset=cls.HEADER_SIZE).reshape(nv, nt)
+        return lut
+
+    # Dictionary interface with the voltage as key
+    def __getitem__(self, v):
+        return dequantize(self.table[self.index(v)], self.scale, self.offset)
+
+    def __contains__(self, v):
+        return np.any(np.isclose(self.volt_vec, v))
+
+    def __iter__(self):
+        return iter(self.volt_vec)
+
+    def __len__(self):
+        return len(self.volt_vec)
+
+    def keys(self):
+        return self.volt_vec
+
+    def values(self):
+        return (self[v] for v in self.volt_vec)
 
-    return input_LUT
+    def items(self):
+        return zip(self.volt_vec, self.values())
@@ -10,8 +10,10 @@ sys.path.insert(0, parent_dir)
 import numpy as np
 from brian2 import *
 from models.models import Barrel_PC, Barrel_IN
+from models.factory import get_model
 
-def scale_to_freq(neuron, input_theory, target, on_all_ratio, clamp_type, duration, hidden_state, dt=0.5, Ni=None):
+def scale_to_freq(neuron, input_theory, target, on_all_ratio, clamp_type, duration, hidden_state, dt=0.5, Ni=None,
+                  search='linear', tol=0.5, scale_range=(1, 300), max_iter=20, scales=None):
     ''' Scales the theoretical input to an input that results in target firing frequence 
         by running test simulations. 
 
@@ -25,6 +27,15 @@ def scale_to_freq(neuron, input_theory, target, on_all_ratio, clamp_type, durati
         hidden_state (array): binary array representing the hidden state
         dt (float): time step of the simulation and hiddenstate
         Ni (int): index of the neuron to be simulated
+        search (str): 'linear' tries the scales 1, 2.5, 5, ..., 300 in order, 'root' brackets the 
+                      target by doubling the scale and narrows it down with safeguarded secant
+                      steps on the (monotone) frequency-scale curve, O(log) simulations.
+                      'group' runs all scales at once as copies of the neuron in one 
+                      NeuronGroup and picks the scale like 'linear'.
+        tol (float): 'root' stops when the frequency is within tol Hz of the target.
+        scale_range (tuple): smallest and largest scale of 'root'.
+        max_iter (int): maximum number of secant steps of 'root'.
+        scales (array): candidate scales of 'group', by default those of 'linear'.
 
         OUTPUT
         inj_input (brian2.TimedArray): the input that results in the target firing frequency
@@ -37,27 +48,57 @@ def scale_to_freq(neuron, input_theory, target, on_all_ratio, clamp_type, durati
         raise TypeError('Please insert a neuron class')
     if clamp_type != 'current' and clamp_type != 'dynamic':
         raise ValueError('ClampType must be \'current\' or \'dynamic\'')
+    if search not in ('linear', 'root', 'group'):
+        raise ValueError('Search must be \'linear\', \'root\' or \'group\'')
 
-    freq_diff_list = []
-    freq_list = []
-    on_freq_list = []
-    scale_list = np.append([1], np.arange(2.5, 302.5, 2.5))
-    for idx, scale in enumerate(scale_list):
+    def simulate(scale):
         neuron.restore()
 
         # Scale and run
         inj = scale_input_theory(input_theory, clamp_type, 0, scale, dt)
         M, S = neuron.run(inj, duration, Ni)
 
-        # Compare against frequency target
+        # Frequency and on_frequency
         freq = S.num_spikes/(duration/1000)
+        spiketrain = make_spiketrain(S, duration, dt)
+        on_freq = get_on_freq(spiketrain, hidden_state, dt)
+        return freq, on_freq
+
+    def check_ratio(scale, freq, on_freq):
+        # Check ON/All ratio
+        neuron.restore()
+        if freq == 0 or on_freq/freq < on_all_ratio:
+            return False
+        return scale_input_theory(input_theory, clamp_type, 0, scale, dt)
+
+    scale_list = np.append([1], np.arange(2.5, 302.5, 2.5))
+    if search == 'root':
+        return check_ratio(*_root_scale_search(simulate, target, tol, scale_range, max_iter))
+    elif search == 'group':
+        scales = scale_list if scales is None else np.asarray(scales, dtype=float)
+        freq, on_freq = simulate_scales(type(neuron), input_theory, scales, clamp_type, duration, hidden_state, dt, Ni)
+
+        # First scale above target, or the prior if it's a better fit
+        above = np.flatnonzero(freq[1:] > target) + 1
+        if len(above) == 0:
+            ideal = len(scales) - 1
+        else:
+            ideal = above[0]
+            if abs(freq[ideal-1] - target) <= abs(freq[ideal] - target):
+                ideal = ideal - 1
+        return check_ratio(scales[ideal], freq[ideal], on_freq[ideal])
+
+    freq_diff_list = []
+    freq_list = []
+    on_freq_list = []
+    for idx, scale in enumerate(scale_list):
+        # Compare against frequency target
+        freq, on_freq = simulate(scale)
         freq_list.append(freq)
         freq_diff = abs(freq - target)
         freq_diff_list.append(freq_diff)
 
         # Compare against on_frequency target
-        spiketrain = make_spiketrain(S, duration, dt)
-        on_freq = get_on_freq(spiketrain, hidden_state, dt)
         on_freq_list.append(on_freq)
 
         if freq > target and idx != 0:
@@ -68,22 +109,77 @@ def scale_to_freq(neuron, input_theory, target, on_all_ratio, clamp_type, durati
                 ideal = idx
 
             # Check ON/OFF ratio
-            if on_freq_list[ideal]/freq_list[ideal] >= on_all_ratio:
-                neuron.restore()
-                return scale_input_theory(input_theory, clamp_type, 0, scale_list[ideal], dt)
-            else:
-                neuron.restore()
-                return False
+            return check_ratio(scale_list[ideal], freq_list[ideal], on_freq_list[ideal])
      
     # When all scales have been tried
-    # Check for ON/All ratio
-    if on_freq/freq < on_all_ratio:
-        neuron.restore()
-        return False
+    return check_ratio(scale_list[-1], freq, on_freq)
+
+
+def simulate_scales(model, input_theory, scales, clamp_type, duration, hidden_state, dt=0.5, Ni=None):
+    ''' Runs the unscaled input through one NeuronGroup with a copy of the neuron
+        per scale, so all scales are simulated in a single run.
+
+        INPUT
+        model (Class): neuron model as found in models.py, e.g. Barrel_PC
+        scales (array): input scale of every copy
+        See scale_to_freq for the other arguments.
+
+        OUTPUT
+        [freq, on_freq]: firing frequency overall and during the ON state (Hz) per scale
+    '''
+    neuron = get_model(model, clamp_type, dt, n=len(scales))
+    neuron.neuron.scale = scales
+    inj = scale_input_theory(input_theory, clamp_type, 0, 1, dt)
+    M, S = neuron.run(inj, duration, Ni)
+
+    # Spike counts per copy, overall and during the ON state
+    hidden_state = np.asarray(hidden_state).flatten()
+    spike_idx = np.clip(np.array(S.t/ms/dt, dtype=int), 0, len(hidden_state) - 1)
+    counts = np.bincount(S.i, minlength=len(scales))
+    on_counts = np.bincount(S.i, weights=hidden_state[spike_idx], minlength=len(scales))
+    freq = counts/(duration/1000)
+    on_freq = on_counts/(np.sum(hidden_state)*dt/1000)
+    return [freq, on_freq]
+
+
+def _root_scale_search(simulate, target, tol, scale_range, max_iter):
+    ''' Finds the scale where the frequency of simulate(scale) reaches target, see 
+        scale_to_freq. Returns [scale, freq, on_freq] of the closest simulated scale.
+    '''
+    lo, max_scale = scale_range
+    f_lo, on_lo = simulate(lo)
+    if f_lo >= target - tol:
+        return [lo, f_lo, on_lo]
+
+    # Bracket the target by doubling the scale
+    hi = lo
+    while True:
+        hi = min(2*hi, max_scale)
+        f_hi, on_hi = simulate(hi)
+        if f_hi >= target or hi == max_scale:
+            break
+        lo, f_lo, on_lo = hi, f_hi, on_hi
+    if f_hi < target or abs(f_hi - target) <= tol:
+        return [hi, f_hi, on_hi]
+
+    # Secant (false position) steps, kept at least 10% from the ends of the bracket
+    for _ in range(max_iter):
+        width = hi - lo
+        scale = lo + (target - f_lo) * width / (f_hi - f_lo)
+        scale = np.clip(scale, lo + 0.1*width, hi - 0.1*width)
+        freq, on_freq = simulate(scale)
+        if abs(freq - target) <= tol:
+            return [scale, freq, on_freq]
+        if freq < target:
+            lo, f_lo, on_lo = scale, freq, on_freq
+        else:
+            hi, f_hi, on_hi = scale, freq, on_freq
+
+    # Closest end of the bracket
+    if target - f_lo <= f_hi - target:
+        return [lo, f_lo, on_lo]
+    return [hi, f_hi, on_hi]
 
-    neuron.restore()
-    return scale_input_theory(input_theory, clamp_type, 0, scale_list[-1], dt)
-    
 def scale_input_theory(input_theory, clamp_type, baseline, scale, dt):
     ''' Scales the theoretical current or dynamic input with a scale factor. 
         
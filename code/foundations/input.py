@@ -13,6 +13,7 @@
 '''
 import numpy as np
 import matplotlib.pyplot as plt
+from scipy import signal
 
 class Input():
     '''Class containing the input parameters.
@@ -32,9 +33,12 @@ class Input():
         self.qoff = []
         self.kernel = None
         self.kerneltau = None
+        self.kerneltau_rise = None
         self.xseed = None
         self.x = None
         self.xfix = None
+        self.nbins = None
+        self.kernel_state = None
 
     # Get dependend variables
     def get_tvec(self):
@@ -43,6 +47,11 @@ class Input():
         self.tvec = np.arange(self.dt, self.T+self.dt, self.dt)
         self.length = len(self.tvec)
 
+    def get_length(self):
+        '''Save the length of tvec without generating it (as np.arange does).
+        '''
+        self.length = int(np.ceil(((self.T+self.dt) - self.dt)/self.dt))
+
     def generate(self):
         '''Generate input and x from fHandle.
         '''
@@ -72,7 +81,7 @@ class Input():
     def get_theta(self):
         '''Generates the firing rate differences.
         '''
-        if self.qon == [] or self.qoff == []:
+        if len(self.qon) == 0 or len(self.qoff) == 0:
             print('Theta not defined, missing qon/qoff')
         else:
             sum(self.qon-self.qoff)
@@ -80,7 +89,7 @@ class Input():
     def get_w(self):
         '''Generates the weight matrix based on qon/qoff.
         '''
-        if self.qon == [] or self.qoff == []:
+        if len(self.qon) == 0 or len(self.qoff) == 0:
             print('Weight not defined, missing qon/qoff')
         else:
             self.w = np.log(self.qon/self.qoff)
@@ -97,15 +106,15 @@ class Input():
 
 
     @staticmethod
-    def create_qonqoff(mutheta, N, alphan, regime, qseed=None):
+    def create_qonqoff(mutheta, N, alphan, regime, rng=None):
         '''Generates normally distributed [qon, qoff] with qon and qoff 
            being a matrix filled  with the firing rate of each neuron based 
-           on the hidden state.
+           on the hidden state. rng is a numpy Generator or a seed for one.
         '''
-        np.random.seed(qseed)
+        rng = np.random.default_rng(rng)
         
-        qoff = np.random.randn(N, 1) 
-        qon = np.random.randn(N, 1)
+        qoff = rng.standard_normal((N, 1)) 
+        qon = rng.standard_normal((N, 1))
         if N > 1:
             #Creates a q distribution with a standard deviation of 1 
             qoff = qoff/np.std(qoff)
@@ -129,15 +138,15 @@ class Input():
     
 
     @staticmethod
-    def create_qonqoff_balanced(N,  meanq, stdq, qseed=None):
+    def create_qonqoff_balanced(N,  meanq, stdq, rng=None):
         '''Generates normally distributed [qon, qoff] with qon and qoff 
            being a matrix filled  with the firing rate of each neuron based 
-           on the hidden state.
+           on the hidden state. rng is a numpy Generator or a seed for one.
         '''
-        np.random.seed(qseed)
+        rng = np.random.default_rng(rng)
 
-        qoff = np.random.randn(N, 1)
-        qon = np.random.randn(N, 1)
+        qoff = rng.standard_normal((N, 1))
+        qon = rng.standard_normal((N, 1))
         if N > 1: 
             qoff = qoff/np.std(qoff)
             qon = qon/np.std(qon)
@@ -151,16 +160,16 @@ class Input():
 
 
     @staticmethod
-    def create_qonqoff_balanced_uniform(N, minq, maxq, qseed=None):
+    def create_qonqoff_balanced_uniform(N, minq, maxq, rng=None):
         '''Generates uniformly distributed [qon, qoff] with qon and qoff 
            being a matrix filled with the firing rate of each neuron based 
-           on the hidden state.
+           on the hidden state. rng is a numpy Generator or a seed for one.
         '''
-        np.random.seed(qseed)
+        rng = np.random.default_rng(rng)
         
-        qoff = np.random.rand(N, 1)
+        qoff = rng.random((N, 1))
         qoff = minq + np.multiply((maxq-minq), qoff)
-        qon = np.random.rand(N, 1)
+        qon = rng.random((N, 1))
         qon = minq + np.multiply((maxq-minq), qon)
         return [qon, qoff]
 
@@ -169,93 +178,407 @@ class Input():
         '''Takes ron and roff from class object and generates
            the hiddenstate if xfix is empty.
         '''
-        np.random.seed(self.xseed)
-        
         # Generate x
-        if self.xfix == None:
-            self.get_p0()
-            xs = np.zeros(np.shape(self.tvec)) 
-
-            #Initial value 
-            i = np.random.rand()
-            if i < self.p0:
-                xs[0] = 1
-            else:
-                xs[0] = 0
-
-            # Make x
-            for n in np.arange(1, self.length): 
-                i = np.random.rand()
-                if xs[n-1] == 1: 
-                    if i < self.roff*self.dt:
-                        xs[n] = 0
-                    else:
-                        xs[n] = 1
-                else: 
-                    if i < self.ron*self.dt:
-                        xs[n] = 1
-                    else:
-                        xs[n] = 0
+        if self.xfix is None:
+            xs = next(rechunk(self.markov_hiddenstate_stream(), self.length))
+            xs = np.array(xs)
         else:
             xs = self.xfix
 
         return xs
 
+    def markov_hiddenstate_stream(self):
+        '''Generator version of markov_hiddenstate, which yields consecutive 
+           pieces of the hiddenstate without end.
+           The ON/OFF dwell times of the discretised two-state Markov chain 
+           are geometrically distributed (p = roff*dt or ron*dt), so they are 
+           drawn in bulk and expanded with np.repeat. The dwell times are drawn 
+           a fixed number of cycles at a time, so the hiddenstate does not 
+           depend on how much of it is taken at once. xseed is a numpy 
+           Generator, SeedSequence or seed.
+        '''
+        rng = np.random.default_rng(self.xseed)
+        self.get_p0()
 
-    def markov_input(self, dynamic=False):
-        '''Takes qon, qoff and hiddenstate and generates input.
-           Optionally when dynamic is a dictinary of g0_values it
-           generates a conductance over time based on the hidden state. 
+        #Initial value 
+        i = rng.random()
+        if i < self.p0:
+            first, second = (1., 0.)
+        else:
+            first, second = (0., 1.)
+        p_leave = {1.: self.roff*self.dt, 0.: self.ron*self.dt}
+
+        # Make x
+        ncycles = 2**8
+        states = np.resize([first, second], 2*ncycles)
+        dwells = np.empty(2*ncycles, dtype=int)
+        while True:
+            dwells[0::2] = self._draw_dwells(rng, p_leave[first], ncycles)
+            dwells[1::2] = self._draw_dwells(rng, p_leave[second], ncycles)
+            yield np.repeat(states, dwells)
+
+    def _draw_dwells(self, rng, p, n):
+        '''Draws n geometric dwell times (in timesteps) for a state
+           that is left with probability p per timestep.
         '''
-        xs = self.x
-        nt = self.length 
-        w = np.log(self.qon/self.qoff) 
+        p = np.minimum(p, 1.)
+        return np.where(p > 0, rng.geometric(np.where(p > 0, p, 1.), n), self.length)
+
+
+    def markov_hiddenstate_batch(self, ntrials):
+        '''Generates the hiddenstate of ntrials independent trials at once
+           as a (ntrials x nt) array, vectorised over the trial axis. Dwell
+           times are drawn as in markov_hiddenstate_stream and every switch 
+           is marked, so the state follows from the parity of the switches.
+        '''
+        rng = np.random.default_rng(self.xseed)
+        self.get_p0()
+
+        #Initial value and the chance to leave the first and second state
+        first = (rng.random(ntrials) < self.p0).astype(float)
+        p_first = np.where(first == 1, self.roff*self.dt, self.ron*self.dt)[:, np.newaxis]
+        p_second = np.where(first == 1, self.ron*self.dt, self.roff*self.dt)[:, np.newaxis]
+        mean_cycle = 1./max(self.roff*self.dt, 1./self.length) + 1./max(self.ron*self.dt, 1./self.length)
+        ncycles = int(np.ceil(self.length/mean_cycle)) + 1
+
+        # Draw dwell times until every trial is covered
+        dwells = np.empty((ntrials, 0), dtype=int)
+        while dwells.sum(axis=1).min() < self.length:
+            cycle = np.empty((ntrials, 2*ncycles), dtype=int)
+            cycle[:, 0::2] = self._draw_dwells(rng, p_first, (ntrials, ncycles))
+            cycle[:, 1::2] = self._draw_dwells(rng, p_second, (ntrials, ncycles))
+            dwells = np.append(dwells, cycle, axis=1)
+
+        # Make x
+        switches = np.cumsum(dwells, axis=1)
+        trial, _ = np.nonzero(switches < self.length)
+        toggle = np.zeros((ntrials, self.length), dtype=np.int8)
+        toggle[trial, switches[switches < self.length]] = 1
+        parity = np.cumsum(toggle, axis=1, dtype=np.int64) % 2
+        xs = np.where(parity == 0, first[:, np.newaxis], 1 - first[:, np.newaxis])
+        return xs
 
-        if dynamic:
-            ni = dynamic.keys()
+    def markov_input_batch(self, weights, method='poisson'):
+        '''Batch version of markov_input_multi for a (ntrials x nt) hiddenstate 
+           in self.x, vectorised over the trial axis. qon/qoff can be shared 
+           (N) or per trial (ntrials x N), as can weights (n_outputs x N) or 
+           (ntrials x n_outputs x N).
+
+           OUTPUT:
+                 ip(array): (ntrials x nt x n_outputs) inputs generated by the ANN.
+        '''
+        xs = np.atleast_2d(self.x)
+        ntrials, nt = np.shape(xs)
+        N = np.shape(weights)[-1]
+        weights = np.reshape(weights, (-1, np.shape(weights)[-2], N))
+        nout = np.shape(weights)[1]
+        qon = np.reshape(self.qon, (-1, N))
+        qoff = np.reshape(self.qoff, (-1, N))
+        rng = np.random.default_rng(self.seed)
+
+        stsum = np.zeros((ntrials, nt, nout))
+        if method == 'bernoulli':
+            # Draw spike chances for all trials, a block of timesteps at a time
+            block = max(1, 2**20//(N*ntrials))
+            for start in range(0, nt, block):
+                stop = min(start + block, nt)
+                qdt = np.where(xs[:, start:stop, np.newaxis] == 1, qon[:, np.newaxis], qoff[:, np.newaxis])*self.dt
+                spikes = (rng.random(np.shape(qdt)) < qdt).astype(float)
+                stsum[:, start:stop] = spikes @ np.transpose(weights, (0, 2, 1))
+        elif method == 'poisson':
+            # Spread Poisson spike counts over the (flattened) timesteps of each state and trial
+            for state, q in ((1, qon), (0, qoff)):
+                state_idx = np.flatnonzero(xs == state)
+                nstate = np.count_nonzero(xs == state, axis=1)
+                offset = np.cumsum(nstate) - nstate
+                counts = rng.poisson(q*self.dt*nstate[:, np.newaxis]*np.ones((ntrials, N)))
+                trial = np.repeat(np.arange(ntrials), counts.sum(axis=1))
+                neuron = np.repeat(np.tile(np.arange(N), ntrials), counts.flatten())
+                spike_idx = state_idx[offset[trial] + rng.integers(nstate[trial])]
+                wtrial = trial if len(weights) > 1 else np.zeros_like(trial)
+                for col in range(nout):
+                    stsum[:, :, col] += np.bincount(spike_idx, weights=weights[wtrial, col, neuron], 
+                                                    minlength=ntrials*nt).reshape(ntrials, nt)
         else:
-            ni = range(len(self.qon))
+            raise ValueError('Method must be \'bernoulli\' or \'poisson\'')
 
-        # Make spike trains (implicit)
-        stsum = np.zeros((nt, 1))
         if self.kernel != None:
-            if self.kernel == 'exponential':
-                tfilt = np.arange(0, 5*self.kerneltau+self.dt, self.dt)
-                kernelf = np.exp(-tfilt/self.kerneltau)
-                kernelf = kernelf/(self.dt*sum(kernelf)) 
-            elif self.kernel == 'delta':
-                kernelf = 1./self.dt
-        
-        xon = np.where(xs==1)
-        xoff = np.where(xs==0)
-        np.random.seed(self.seed)
-        
-        # Create the input generated by the artificial neural network
-        for k in ni:
-            randon = np.random.rand(np.shape(xon)[0],np.shape(xon)[1])
-            randoff = np.random.rand(np.shape(xoff)[0], np.shape(xoff)[1])
-            sttemp = np.zeros((nt, 1))
-            sttempon = np.zeros(np.shape(xon))
-            sttempoff = np.zeros(np.shape(xoff))
-
-            sttempon[randon < self.qon[k]*self.dt] = 1.
-            sttempoff[randoff < self.qoff[k]*self.dt] = 1.
-            
-            sttemp[xon] = np.transpose(sttempon)
-            sttemp[xoff] = np.transpose(sttempoff)
-
-            if dynamic:
-                stsum = stsum + dynamic[k]*sttemp
-            else:
-                stsum = stsum + w[k]*sttemp 
-
-            # #SanityCheck for individual spikes
-            # plt.plot(sttemp)
-            # plt.show()
+            filtered = np.transpose(stsum, (1, 0, 2)).reshape(nt, ntrials*nout)
+            self.apply_kernel(filtered)
+            stsum = np.transpose(filtered.reshape(nt, ntrials, nout), (1, 0, 2))
+
+        ip = stsum
+        return ip
+
+    def markov_input(self, dynamic=False, method='bernoulli'):
+        '''Takes qon, qoff and hiddenstate and generates input.
+           Optionally when dynamic is an array of g0 values (see 
+           dynamic_clamp.get_g0, e.g. g0 * exc) it generates a conductance 
+           over time based on the hidden state. 
+        '''
+        N = len(self.qon)
+        if dynamic is not False:
+            weights = np.reshape(dynamic, (1, N))
+        else:
+            weights = np.log(self.qon/self.qoff).reshape(1, N)
 
+        ip = self.markov_input_multi(weights, method)
         if self.kernel != None:
-            stsum = np.convolve(stsum.flatten(), kernelf, mode='full')
+            return ip[:, 0]
+        return ip
+
+
+    def markov_input_multi(self, weights, method='bernoulli'):
+        '''Takes qon, qoff and hiddenstate and generates a single spike 
+           realisation of the artificial network. Every row of weights is
+           used to sum that same realisation into its own input, so e.g. 
+           input_theory, g_exc and g_inh can be made in one pass.
+
+           INPUT:
+                 weights(array): (n_outputs x N) weight of each neuron per output.
+                 method(str): 'bernoulli' draws a spike chance for every neuron 
+                              and timestep, O(N*T). 'poisson' samples the spike 
+                              events directly, O(N + number of spikes). 'binned' 
+                              approximates the network with nbins groups of 
+                              similar weights, O(nbins*T), see binned_error.
+           OUTPUT:
+                 ip(array): (nt x n_outputs) inputs generated by the ANN.
+        '''
+        xs = np.asarray(self.x).flatten()
+        ip = np.concatenate([ip for _, ip in self.markov_input_stream([xs], weights, method)])
+        return ip
+
+    def markov_input_stream(self, xs_stream, weights, method='bernoulli'):
+        '''Generator version of markov_input_multi. Takes an iterable of 
+           consecutive pieces of the hiddenstate and yields consecutive 
+           [xs, ip] blocks. Spikes are drawn a fixed block of timesteps at 
+           a time and the kernel state carries over between blocks, so the 
+           input does not depend on how the hiddenstate is split. seed is a 
+           numpy Generator, SeedSequence or seed.
+        '''
+        weights = np.atleast_2d(weights)
+        qon = np.asarray(self.qon).flatten()
+        qoff = np.asarray(self.qoff).flatten()
+        N = len(qon)
+
+        if method == 'bernoulli':
+            spike_sum = self._bernoulli_spike_sum
+            block = max(1, 2**20//N)
+        elif method == 'poisson':
+            spike_sum = self._poisson_spike_sum
+            block = 2**16
+        elif method == 'binned':
+            spike_sum = self._binned_spike_sum
+            qon, qoff, weights = self.get_weight_bins(weights)
+            block = max(1, 2**20//len(qon))
+        else:
+            raise ValueError('Method must be \'bernoulli\', \'poisson\' or \'binned\'')
+
+        # Make spike trains (implicit), a block of timesteps at a time
+        rng = np.random.default_rng(self.seed)
+        self.kernel_state = None
+        for xs in rechunk(xs_stream, block):
+            stsum = spike_sum(rng, xs, qon, qoff, weights)
+            if self.kernel != None:
+                self.apply_kernel(stsum, carry=True)
+            yield [xs, stsum]
+
+    def get_kernel(self):
+        '''Generates the synaptic kernel, truncated at 5*kerneltau and
+           normalised to an integral of 1. Options are 'exponential', 
+           'alpha', 'biexponential' (decay kerneltau, rise kerneltau_rise) 
+           and 'delta'.
+        '''
+        if self.kernel == 'delta':
+            return np.array([1./self.dt])
+        tfilt = np.arange(0, 5*self.kerneltau+self.dt, self.dt)
+        if self.kernel == 'exponential':
+            kernelf = np.exp(-tfilt/self.kerneltau)
+        elif self.kernel == 'alpha':
+            kernelf = tfilt*np.exp(-tfilt/self.kerneltau)
+        elif self.kernel == 'biexponential':
+            kernelf = np.exp(-tfilt/self.kerneltau) - np.exp(-tfilt/self.kerneltau_rise)
+        else:
+            raise ValueError('Kernel must be \'exponential\', \'alpha\', \'biexponential\' or \'delta\'')
+        return kernelf/(self.dt*sum(kernelf))
+
+    def get_kernel_filters(self):
+        '''Exact recursive (IIR) form of the truncated kernel from get_kernel.
+           Returns a list of (taps, a) with taps a sparse numerator {lag: coefficient}
+           and a the denominator, the filtered input is the sum over all terms.
+           The taps at lag M (kernel length) cancel the tail of the exponentials.
+        '''
+        if self.kernel == 'delta':
+            return [({0: 1./self.dt}, [1.])]
+        kernelf = self.get_kernel()
+        M = len(kernelf)
+        if self.kernel == 'exponential':
+            a = np.exp(-self.dt/self.kerneltau)
+            c = kernelf[0]
+            return [({0: c, M: -c*a**M}, [1., -a])]
+        elif self.kernel == 'alpha':
+            a = np.exp(-self.dt/self.kerneltau)
+            c = kernelf[1]/a
+            return [({1: c*a, M: -c*M*a**M, M+1: c*(M-1)*a**(M+1)}, [1., -2*a, a**2])]
+        elif self.kernel == 'biexponential':
+            c = 1./(self.dt*sum(np.exp(-np.arange(M)*self.dt/self.kerneltau) 
+                                - np.exp(-np.arange(M)*self.dt/self.kerneltau_rise)))
+            filters = []
+            for tau, sign in ((self.kerneltau, 1.), (self.kerneltau_rise, -1.)):
+                a = np.exp(-self.dt/tau)
+                filters.append(({0: sign*c, M: -sign*c*a**M}, [1., -a]))
+            return filters
+
+    def apply_kernel(self, stsum, carry=False):
+        '''Filters stsum (nt x n_outputs) in place with the kernel, using its 
+           recursive form so the cost is O(nt) instead of O(nt*kernel length).
+           Equal to np.convolve(stsum, get_kernel())[0:nt] per output. With 
+           carry the filter continues from (and updates) self.kernel_state, 
+           so consecutive pieces can be filtered as one.
+        '''
+        nt, nout = np.shape(stsum)
+        filters = self.get_kernel_filters()
+        if carry and self.kernel_state is not None:
+            history, zi = self.kernel_state
+        else:
+            history = np.zeros((max(max(taps) for taps, _ in filters), nout))
+            zi = [np.zeros((len(a) - 1, nout)) for _, a in filters]
+        nh = len(history)
+        padded = np.concatenate((history, stsum))
+
+        filtered = np.zeros_like(stsum)
+        for n, (taps, a) in enumerate(filters):
+            u = np.zeros_like(stsum)
+            for lag, coef in taps.items():
+                u += coef*padded[nh-lag:nh-lag+nt]
+            if len(a) > 1:
+                u, zi[n] = signal.lfilter([1.], a, u, axis=0, zi=zi[n])
+            filtered += u
+
+        if carry:
+            self.kernel_state = (padded[len(padded)-nh:], zi)
+        stsum[:] = filtered
+        return stsum
+
+    def _bernoulli_spike_sum(self, rng, xs, qon, qoff, weights):
+        '''Weighted spike sums of all neurons for the timesteps in xs, 
+           every neuron spikes with chance q*dt per timestep.
+        '''
+        qdt = np.where(xs[:, np.newaxis] == 1, qon, qoff)*self.dt
+        spikes = rng.random((len(xs), len(qon))) < qdt
+
+        # #SanityCheck for individual spikes
+        # plt.plot(spikes[:, 0])
+        # plt.show()
+
+        return spikes @ weights.T
+
+    def _poisson_spike_sum(self, rng, xs, qon, qoff, weights):
+        '''Weighted spike sums of all neurons for the timesteps in xs, 
+           with the spike events sampled directly. Every neuron fires a 
+           Poisson number of spikes in the ON and OFF time, which are 
+           spread uniformly over the timesteps of that state. This is 
+           equal to exponential inter-spike intervals within each state.
+        '''
+        stsum = np.zeros((len(xs), len(weights)))
+        for state, q in ((1, qon), (0, qoff)):
+            state_idx = np.flatnonzero(xs == state)
+            if len(state_idx) == 0:
+                continue
+            counts = rng.poisson(q*self.dt*len(state_idx))
+            neuron = np.repeat(np.arange(len(q)), counts)
+            spike_idx = state_idx[rng.integers(len(state_idx), size=len(neuron))]
+            for col in range(len(weights)):
+                stsum[:, col] += np.bincount(spike_idx, weights=weights[col, neuron], minlength=len(xs))
+        return stsum
+
+    def _binned_spike_sum(self, rng, xs, rate_on, rate_off, weights):
+        '''Weighted spike sums for the timesteps in xs of the binned 
+           network from get_weight_bins, every bin fires a Poisson number
+           of spikes per timestep.
+        '''
+        w_on, w_off = weights
+        ratedt = np.where(xs[:, np.newaxis] == 1, rate_on, rate_off)*self.dt
+        counts = rng.poisson(ratedt)
+        return np.where(xs[:, np.newaxis] == 1, counts @ w_on.T, counts @ w_off.T)
+
+    def get_weight_bins(self, weights):
+        '''Groups the neurons in nbins bins of similar weight (first row 
+           of weights). Each bin fires with the summed rate of its neurons 
+           and the rate weighted mean weight per state, so the mean input 
+           is exact and only the variance is approximated.
+
+           OUTPUT:
+                 [rate_on, rate_off, (w_on, w_off)]: summed qon/qoff of each bin 
+                 and the (n_outputs x nbins) weights in the ON and OFF state.
+        '''
+        if self.nbins == None:
+            raise ValueError('Binned input not defined, missing nbins')
+        weights = np.atleast_2d(weights)
+        qon = np.asarray(self.qon).flatten()
+        qoff = np.asarray(self.qoff).flatten()
+        bins = np.array_split(np.argsort(weights[0]), min(self.nbins, len(qon)))
+
+        rate_on = np.array([qon[b].sum() for b in bins])
+        rate_off = np.array([qoff[b].sum() for b in bins])
+        w_on = np.array([weights[:, b] @ qon[b] for b in bins]).T
+        w_off = np.array([weights[:, b] @ qoff[b] for b in bins]).T
+        w_on = np.divide(w_on, rate_on, out=np.zeros_like(w_on), where=rate_on > 0)
+        w_off = np.divide(w_off, rate_off, out=np.zeros_like(w_off), where=rate_off > 0)
+        return [rate_on, rate_off, (w_on, w_off)]
+
+    def binned_error(self, weights):
+        '''Reports the approximation error of the binned network against 
+           the exact (bernoulli) network, per state and output, as the relative 
+           error of the mean and variance of the summed spikes per timestep.
+        '''
+        weights = np.atleast_2d(weights)
+        rate_on, rate_off, (w_on, w_off) = self.get_weight_bins(weights)
+        qon = np.asarray(self.qon).flatten()
+        qoff = np.asarray(self.qoff).flatten()
+
+        error = {}
+        for state, q, rate, w in (('on', qon, rate_on, w_on), ('off', qoff, rate_off, w_off)):
+            qdt = q*self.dt
+            mean_exact = weights @ qdt
+            var_exact = weights**2 @ (qdt*(1 - qdt))
+            mean_binned = w @ (rate*self.dt)
+            var_binned = w**2 @ (rate*self.dt)
+            error[state] = {'mean' : abs(mean_binned - mean_exact)/abs(mean_exact),
+                            'var' : abs(var_binned - var_exact)/var_exact}
+        return error
+
+
+def rechunk(pieces, size, total=None):
+    '''Regroups an iterable of consecutive arrays (or lists of arrays) into
+       chunks of size along the first axis. The last chunk can be shorter.
+       Optionally stops after total elements.
+    '''
+    buffer = []
+    buffered = 0
+    taken = 0
+    for piece in pieces:
+        single = not isinstance(piece, (list, tuple))
+        if single:
+            piece = [piece]
+        if total is not None:
+            piece = [p[:total-taken] for p in piece]
+        taken += len(piece[0])
+        buffer.append(piece)
+        buffered += len(piece[0])
+
+        # Yield all complete chunks
+        if buffered >= size:
+            joined = [np.concatenate(parts) for parts in zip(*buffer)]
+            nchunks = buffered//size
+            for n in range(nchunks):
+                chunk = [j[n*size:(n+1)*size] for j in joined]
+                yield chunk[0] if single else chunk
+            buffer = [[j[nchunks*size:] for j in joined]]
+            buffered -= nchunks*size
+        if total is not None and taken >= total:
+            break
 
-        stsum = stsum[0:nt]
-        ip = stsum 
-        return ip
\ No newline at end of file
+    if buffered > 0:
+        joined = [np.concatenate(parts) for parts in zip(*buffer)]
+        yield joined[0] if single else joined
@@ -18,10 +18,10 @@ sys.path.insert(0, parent_dir)
 
 import numpy as np
 import matplotlib.pyplot as plt
-from foundations.dynamic_clamp import get_g0
-from foundations.input import Input
+from foundations.dynamic_clamp import get_g0, quantize
+from foundations.input import Input, rechunk
 
-def make_dynamic_experiments(qon_qoff_type, baseline, tau, factor_ron_roff, mean_firing_rate, sampling_rate, duration, seed=None):
+def make_dynamic_experiments(qon_qoff_type, baseline, tau, factor_ron_roff, mean_firing_rate, sampling_rate, duration, seed=None, method='bernoulli', N=1000, nbins=100, precision='float64'):
     ''' Make input current look up table (LUT) based on a artificial network responding
         to a hidden state.
 
@@ -36,24 +36,130 @@ def make_dynamic_experiments(qon_qoff_type, baseline, tau, factor_ron_roff, mean
                              in kilohertz.
         duration (ms): Length of the duration in milliseconds.
         dv (float): resolution of voltage steps  
-        seed (optional): Seed used in the random number generator.
+        seed (optional): Seed or numpy SeedSequence of the experiment, the qon/qoff, hidden 
+                         state and spikes each get their own child stream of it.
+        method (str): Spike generation of the artificial neurons, 'bernoulli' (per timestep) 
+                      or 'poisson' (event-driven, scales with the number of spikes)
+                      or 'binned' (approximation with nbins groups, scales with nbins).
+        N (int): Number of artificial neurons.
+        nbins (int): Number of weight bins when method is 'binned'.
+        precision (str): Precision of the conductances, 'float64', 'float32' or 'int16'. 
+                         With 'int16' every conductance is a [data, scale, offset] list
+                         (see dynamic_clamp.quantize and dequantize).
 
     OUTPUT: 
         exc_LUT(dict): dictionary of the injected current per voltage.
         inh_LUT(dict): dictionary of the injected current per voltage.
         hidden_state: 1xN array with hidden state values 0=off 1=on.
     '''
-    # Set RNG seed, if no seed is provided
-    if seed == None:
-        np.random.seed()
-        seed = np.random.randint(1000000000)
+    input_bayes, weights = _make_input(qon_qoff_type, tau, factor_ron_roff, mean_firing_rate, sampling_rate, duration, seed, N, nbins)
+    
+    #Generate hiddenstate
+    input_bayes.x = input_bayes.markov_hiddenstate()
+
+    #Generate input_current for comparison and exc and inh from one spike realisation
+    input_theory, g_exc, g_inh = input_bayes.markov_input_multi(weights, method).T
+    dynamic_theory = (to_precision(g_exc, precision), to_precision(g_inh, precision))
+   
+    # #SanityCheck for input (Vm=-40) and hiddenstate
+    # fig, axs = plt.subplots(2, figsize=(12,12))
+    # fig.suptitle('Dynamic Clamp conductances')
+
+    # for idx, val in enumerate(input_bayes.x):
+    #     if val == 1:
+    #         axs[0].axvline(idx, c='lightgray')
+    #         axs[1].axvline(idx, c='lightgray')
+
+    # axs[0].plot(g_exc, c='red')
+    # axs[0].set(ylabel='Exc. conductance [mS]')
+
+    # axs[1].plot(g_inh, c='blue')
+    # axs[1].set(ylabel='Inh. conductance [mS]')
+    
+    # plt.show()
+
+    return [input_theory, dynamic_theory, input_bayes.x]
+
+
+def iter_dynamic_experiments(qon_qoff_type, baseline, tau, factor_ron_roff, mean_firing_rate, sampling_rate, duration, chunk_duration, seed=None, method='bernoulli', N=1000, nbins=100, precision='float64'):
+    ''' Generator version of make_dynamic_experiments that yields the experiment in 
+        consecutive chunks, so long stimuli never have to be held in memory at once. 
+        The Markov and kernel state carry over between chunks and the concatenated 
+        chunks are equal to make_dynamic_experiments with the same seed.
+
+    INPUT:
+        See make_dynamic_experiments.
+        chunk_duration (ms): Length of a chunk in milliseconds.
+
+    OUTPUT (per chunk): 
+        [hidden_state, input_theory, g_exc, g_inh]: arrays of the chunk length, 
+                                                   with 'int16' the scale is per chunk.
+    '''
+    input_bayes, weights = _make_input(qon_qoff_type, tau, factor_ron_roff, mean_firing_rate, sampling_rate, duration, seed, N, nbins)
+    chunk = max(1, int(round(chunk_duration*sampling_rate)))
+
+    hiddenstate = rechunk(input_bayes.markov_hiddenstate_stream(), chunk, input_bayes.length)
+    inputs = input_bayes.markov_input_stream(hiddenstate, weights, method)
+    for xs, ip in rechunk(inputs, chunk):
+        input_theory, g_exc, g_inh = ip.T
+        yield [xs, input_theory, to_precision(g_exc, precision), to_precision(g_inh, precision)]
+
+
+def to_precision(g, precision):
+    ''' Converts a conductance to precision, float arrays are returned as is and 
+        'int16' as the [data, scale, offset] list of quantize.
+    '''
+    data, scale, offset = quantize(g, precision)
+    return [data, scale, offset] if precision == 'int16' else data
+
+
+def make_dynamic_experiments_batch(qon_qoff_type, baseline, tau, factor_ron_roff, mean_firing_rate, sampling_rate, duration, ntrials, seed=None, method='poisson', N=1000, shared_q=True, frozen=None):
+    ''' Batch version of make_dynamic_experiments, which generates ntrials trials at once 
+        as (ntrials x nt) arrays, vectorised over the trial axis instead of a Python loop.
+
+    INPUT:
+        See make_dynamic_experiments, method is 'bernoulli' or 'poisson'.
+        ntrials (int): Number of trials.
+        shared_q (bool): All trials share qon/qoff (and weights) or each trial draws its own.
+        frozen (str): 'hidden_state' repeats one hidden state in all trials, 'input' repeats 
+                      the hidden state and input (frozen noise), None gives independent trials.
+
+    OUTPUT: 
+        [input_theory, (g_exc, g_inh), hidden_state]: (ntrials x nt) arrays.
+    '''
+    if frozen not in (None, 'hidden_state', 'input'):
+        raise ValueError('Frozen must be None, \'hidden_state\' or \'input\'')
+    nq = 1 if shared_q or frozen == 'input' else ntrials
+    input_bayes, weights = _make_input(qon_qoff_type, tau, factor_ron_roff, mean_firing_rate, sampling_rate, duration, seed, N, None, nq)
+    
+    #Generate hiddenstate
+    if frozen == None:
+        input_bayes.x = input_bayes.markov_hiddenstate_batch(ntrials)
+    elif frozen == 'hidden_state':
+        input_bayes.x = np.broadcast_to(input_bayes.markov_hiddenstate_batch(1), (ntrials, input_bayes.length))
+    else:
+        input_bayes.x = input_bayes.markov_hiddenstate_batch(1)
+
+    #Generate input_current, exc and inh of all trials
+    ip = input_bayes.markov_input_batch(weights, method)
+    hidden_state = np.broadcast_to(input_bayes.x, (ntrials, input_bayes.length))
+    input_theory, g_exc, g_inh = np.moveaxis(np.broadcast_to(ip, (ntrials,) + np.shape(ip)[1:]), 2, 0)
+    return [input_theory, (g_exc, g_inh), hidden_state]
+
+
+def _make_input(qon_qoff_type, tau, factor_ron_roff, mean_firing_rate, sampling_rate, duration, seed, N, nbins, nq=1):
+    ''' Creates the Input object of the artificial network and the (3 x N) weights of 
+        its neurons for input_theory, g_exc and g_inh. With nq > 1 every trial gets its 
+        own qon/qoff (nq x N) and weights (nq x 3 x N).
+    '''
+    # Spawn child RNG streams from the seed of the experiment (fresh entropy if no seed is provided)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    qseed, xseed, spikeseed = [_child_seed(seed, i) for i in range(3)]
 
     # Fixed parameters
-    N = 1000                            
     dt = 1./sampling_rate
     tau_exponential_kernel = 5 
-    alpha = np.sqrt(1/8)            # SEM * N
-    stdq = alpha*mean_firing_rate
     ron = 1./(tau*(1+factor_ron_roff))
     roff = factor_ron_roff*ron
     v_rest = -65
@@ -67,52 +173,54 @@ def make_dynamic_experiments(qon_qoff_type, baseline, tau, factor_ron_roff, mean
     input_bayes.kerneltau = tau_exponential_kernel
     input_bayes.ron = ron
     input_bayes.roff = roff
-    input_bayes.seed = seed
-    input_bayes.xseed = seed
+    input_bayes.seed = spikeseed
+    input_bayes.xseed = xseed
+    input_bayes.nbins = nbins
 
     # Create qon/qoff
+    if nq == 1:
+        [input_bayes.qon, input_bayes.qoff] = _make_qonqoff(qon_qoff_type, N, mean_firing_rate, qseed)
+    else:
+        qonqoff = [_make_qonqoff(qon_qoff_type, N, mean_firing_rate, _child_seed(qseed, n)) for n in range(nq)]
+        input_bayes.qon = np.hstack([qon for qon, _ in qonqoff]).T
+        input_bayes.qoff = np.hstack([qoff for _, qoff in qonqoff]).T
+    
+    #Generate weights (without the full tvec)
+    input_bayes.get_length()
+    input_bayes.get_tau()
+    input_bayes.get_p0()
+    input_bayes.get_w()
+
+    #Weights of input_current, exc and inh
+    w = np.reshape(input_bayes.w, (nq, N))
+    g0, exc, inh = get_g0(v_rest, w, Er_exc, Er_inh)
+    weights = np.stack((w, g0 * exc, g0 * inh), axis=1)
+    if nq == 1:
+        weights = weights[0]
+    return [input_bayes, weights]
+
+
+def _make_qonqoff(qon_qoff_type, N, mean_firing_rate, qseed):
+    ''' Creates [qon, qoff] of the artificial network following qon_qoff_type.
+    '''
+    alpha = np.sqrt(1/8)            # SEM * N
+    stdq = alpha*mean_firing_rate
     if qon_qoff_type == 'normal':
         mutheta = 1             #The summed difference between qon and qoff
         alphan = alpha
         regime = 1
-        [input_bayes.qon, input_bayes.qoff] = input_bayes.create_qonqoff(mutheta, N, alphan, regime, seed)
+        return Input.create_qonqoff(mutheta, N, alphan, regime, qseed)
     elif qon_qoff_type == 'balanced':
-        [input_bayes.qon, input_bayes.qoff] = input_bayes.create_qonqoff_balanced(N, mean_firing_rate, stdq, seed)
+        return Input.create_qonqoff_balanced(N, mean_firing_rate, stdq, qseed)
     elif qon_qoff_type == 'balanced_uniform':
         minq = 10                  
         maxq = 100
-        [input_bayes.qon, input_bayes.qoff] = input_bayes.create_qonqoff_balanced_uniform(N, minq, maxq, seed)
+        return Input.create_qonqoff_balanced_uniform(N, minq, maxq, qseed)
     else: 
         raise SyntaxError('No qon/qoff creation type specified')
-    
-    #Generate weights and hiddenstate
-    input_bayes.get_all()
-    input_bayes.x = input_bayes.markov_hiddenstate()
 
-    #Generate exc and inh
-    g0_exc, g0_inh = get_g0(v_rest, input_bayes.w, Er_exc, Er_inh)
-    g_exc = input_bayes.markov_input(g0_exc)
-    g_inh = input_bayes.markov_input(g0_inh)
-    dynamic_theory = (g_exc, g_inh)
 
-    #Generate input_current for comparison
-    input_theory = input_bayes.markov_input()
-   
-    # #SanityCheck for input (Vm=-40) and hiddenstate
-    # fig, axs = plt.subplots(2, figsize=(12,12))
-    # fig.suptitle('Dynamic Clamp conductances')
-
-    # for idx, val in enumerate(input_bayes.x):
-    #     if val == 1:
-    #         axs[0].axvline(idx, c='lightgray')
-    #         axs[1].axvline(idx, c='lightgray')
-
-    # axs[0].plot(g_exc, c='red')
-    # axs[0].set(ylabel='Exc. conductance [mS]')
-
-    # axs[1].plot(g_inh, c='blue')
-    # axs[1].set(ylabel='Inh. conductance [mS]')
-    
-    # plt.show()
-
-    return [input_theory, dynamic_theory, input_bayes.x]
+def _child_seed(seed, n):
+    ''' The n-th child of a SeedSequence, derived without changing the parent.
+    '''
+    return np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (n,))
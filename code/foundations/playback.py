@@ -0,0 +1,172 @@
+'''
+    playback.py
+
+    Closed-loop playback of dynamic clamp conductances the way the rig does it: every sample
+    the membrane potential is read, the current g_exc(t) * (V - Er_exc) + g_inh(t) * (V - Er_inh)
+    is computed (directly or from the LUTs) and injected into a cell. The cell is a local
+    stand-in, the Barrel_PC equations in numpy or a recorded voltage trace, and the per sample
+    compute latency and loop jitter are recorded to check if the LUT resolution and sampling
+    rate fit in the real-time budget before going on the rig.
+'''
+import os,sys,inspect
+current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+import time
+import numpy as np
+from models.parameters import get_parameters
+
+class PCStandIn:
+    ''' Numpy version of the Barrel_PC model (models.py) that is stepped one sample at
+        a time with a constant injected current, as a stand-in for the cell on the rig.
+
+        INPUT:
+              Ni(int): index of the fitted parameters in PC_parameters.csv.
+              v0(float): initial membrane potential in mV.
+
+        Units are mV, ms, mS, uF and uA. The membrane potential is integrated with exponential
+        Euler, the Na gates are instantaneous like in Barrel_PC.
+    '''
+    def __init__(self, Ni=0, v0=-65.):
+        parameters = get_parameters('PC')
+        area = 1e-4/20000e-12   # cm**2/area of Barrel_PC
+        self.gL = parameters.values('gL')[Ni]*area*1e3
+        self.gK = parameters.values('gK')[Ni]*area*1e3
+        self.Cm = parameters.values('Cm')[Ni]*area*1e6
+        self.gNa = parameters.values('gNa')[Ni]*area*1e3
+        self.k_m, self.k_h, self.Vh_h = [parameters.values(name)[Ni]*1e3 for name in ('k_m', 'k_h', 'Vh_h')]
+        self.Vh_m = 3.583881 * self.k_m - 53.294454
+        self.EL, self.ENa, self.EK, self.VT = -65., 50., -90., -63.
+        self.v = v0
+        self.n = 0.
+
+    def step(self, I_inj, dt):
+        ''' Advances the cell dt ms with injected current I_inj (uA), returns the new V (mV).
+        '''
+        v = self.v
+        m = 1 / (1 + np.exp(-(v - self.Vh_m) / self.k_m))
+        h = 1 / (1 + np.exp((v - self.Vh_h) / self.k_h))
+        x = (15. - v + self.VT) / 5.
+        alpha_n = 0.032 * 5. / (np.expm1(x) / x if x != 0 else 1.)
+        beta_n = 0.5 * np.exp((10. - v + self.VT) / 40.)
+
+        # Exponential Euler: exact for v and n with the gates and current held fixed over dt
+        g = np.array([self.gL, self.gNa * m**3 * h, self.gK * self.n**4])
+        g_total = g.sum()
+        v_inf = (g @ [self.EL, self.ENa, self.EK] + I_inj) / g_total
+        self.v = v_inf + (v - v_inf) * np.exp(-dt * g_total / self.Cm)
+        n_inf = alpha_n / (alpha_n + beta_n)
+        self.n = n_inf + (self.n - n_inf) * np.exp(-dt * (alpha_n + beta_n))
+        return self.v
+
+
+class TraceStandIn:
+    ''' Stand-in cell that plays back a recorded voltage trace (array or text file
+        readable by np.loadtxt) and ignores the injected current, to benchmark the loop
+        with realistic voltages. The trace is repeated if it is shorter than the playback.
+    '''
+    def __init__(self, trace):
+        self.trace = np.loadtxt(trace) if isinstance(trace, str) else np.asarray(trace, dtype=float)
+        self.idx = 0
+        self.v = self.trace[0]
+
+    def step(self, I_inj, dt):
+        self.idx = (self.idx + 1) % len(self.trace)
+        self.v = self.trace[self.idx]
+        return self.v
+
+
+def playback(g_exc, g_inh, cell, dt, Er_exc=0., Er_inh=-75., luts=None, realtime=True):
+    ''' Replays the conductances in a fixed-rate closed loop: read V of the cell, compute
+        the current and step the cell, one sample per dt.
+
+        INPUT:
+              g_exc, g_inh(array): conductances in mS (scaled, see helpers.scale_input_theory).
+              cell: stand-in with a v attribute and a step(I_inj, dt) method,
+                    e.g. PCStandIn or TraceStandIn.
+              dt(float): sample interval in ms (1/sampling_rate).
+              Er_exc/inh(float): reversal potentials in mV.
+              luts(tuple, optional): (exc_LUT, inh_LUT) InputLUTs made with Er_exc and Er_inh,
+                                     the current is then read from their tables (built before
+                                     the loop starts) at the voltage resolution of the LUTs
+                                     (see compare_luts).
+              realtime(bool): wait (busy) for the sample clock like the rig, or run
+                              as fast as possible and only measure the compute latency.
+        OUTPUT:
+              results(dict): 'v' (mV) and 'I_inj' (uA) per sample, 'latency' (us) from reading
+                             V to the output current, 'jitter' (us) of the loop start to the sample
+                             clock, 'overruns' the number of samples that started after the next
+                             sample was due and 'budget' (us) the sample interval.
+    '''
+    g_exc = np.asarray(g_exc, dtype=float)
+    g_inh = np.asarray(g_inh, dtype=float)
+    nt = len(g_exc)
+    v_trace = np.empty(nt)
+    I_trace = np.empty(nt)
+    latency = np.empty(nt, dtype=np.int64)
+    jitter = np.empty(nt, dtype=np.int64)
+    dt_ns = int(round(dt * 1e6))
+
+    # Build (or read) the tables before the clock starts, so the loop times a table read
+    if luts is not None:
+        for lut in luts:
+            lut.table
+
+    clock = time.perf_counter_ns
+    start = clock()
+    for i in range(nt):
+        deadline = start + i * dt_ns
+        if realtime:
+            while clock() < deadline:
+                pass
+        t0 = clock()
+
+        # Read V and compute the current
+        v = cell.v
+        if luts is None:
+            I_inj = g_exc[i] * (v - Er_exc) + g_inh[i] * (v - Er_inh)
+        else:
+            I_inj = luts[0].lookup(v, i) + luts[1].lookup(v, i)
+        t1 = clock()
+
+        cell.step(I_inj, dt)
+        v_trace[i], I_trace[i] = v, I_inj
+        latency[i] = t1 - t0
+        jitter[i] = t0 - deadline
+
+    return {'v' : v_trace, 'I_inj' : I_trace, 'latency' : latency / 1e3, 'jitter' : jitter / 1e3,
+            'overruns' : int(np.sum(jitter >= dt_ns)) if realtime else None, 'budget' : dt * 1e3}
+
+
+def compare_luts(g_exc, g_inh, luts, trace, dt, Er_exc=0., Er_inh=-75.):
+    ''' Checks that the LUT path of playback injects the same current as the direct path:
+        both are played back on the same recorded voltage trace (TraceStandIn).
+
+        OUTPUT:
+              [I_direct, I_lut, max_error]: injected currents (uA) of both paths and their
+                                            largest absolute difference, which should stay
+                                            within the voltage step and precision of the LUTs.
+    '''
+    direct = playback(g_exc, g_inh, TraceStandIn(trace), dt, Er_exc, Er_inh, realtime=False)
+    lut = playback(g_exc, g_inh, TraceStandIn(trace), dt, Er_exc, Er_inh, luts=luts, realtime=False)
+    return [direct['I_inj'], lut['I_inj'], np.max(np.abs(direct['I_inj'] - lut['I_inj']))]
+
+
+def latency_report(results, bins=50):
+    ''' Summary and histograms of the latency and jitter of playback.
+
+        OUTPUT:
+              report(dict): per 'latency' and 'jitter' the mean, median, 99th percentile and
+                            max (us) and the histogram (counts, bin_edges). 'budget_used' is the
+                            99th percentile latency as a fraction of the sample interval.
+    '''
+    report = {}
+    for key in ('latency', 'jitter'):
+        values = results[key]
+        report[key] = {'mean' : np.mean(values), 'median' : np.median(values),
+                       'p99' : np.percentile(values, 99), 'max' : np.max(values),
+                       'histogram' : np.histogram(values, bins=bins)}
+    report['budget_used'] = report['latency']['p99'] / results['budget']
+    report['overruns'] = results['overruns']
+    return report
@@ -0,0 +1,73 @@
+''' factory.py
+
+    Compile-once cache of the neuron models. Building a Barrel_PC or Barrel_IN parses the
+    equations and creates the NeuronGroup and monitors, so scripts that make a new model in
+    every loop iteration pay that every time. get_model builds each model once per process,
+    keyed by (model, clamp type, dt, recorded variables, size), stores its initial state and
+    hands out the same model restored to that state on every later call. From the first
+    get_model the code Brian2 compiles (cython target) is kept in a managed cache directory,
+    so it is reused by later runs of the scripts as well.
+'''
+import os
+import shutil
+import brian2 as b2
+from models.models import Barrel_PC, Barrel_IN
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'results', 'cache', 'brian2')
+MODELS = {'PC' : Barrel_PC, 'IN' : Barrel_IN}
+
+_models = {}
+
+def set_cache_dir(cache_dir=CACHE_DIR):
+    ''' Lets Brian2 keep the compiled code of the models in cache_dir. get_model does
+        this with CACHE_DIR on its first call, unless a cache directory is set already.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    b2.prefs.codegen.runtime.cython.cache_dir = cache_dir
+
+
+def get_model(model, clamp_type, dt=0.5, tracking=('v', 'I_inj'), n=1, population=False):
+    ''' Returns the model, built the first time it is asked for and restored to its
+        initial state (time, state variables and empty monitors) on every later call.
+
+        INPUT:
+              model (str or Class): 'PC', 'IN' or the model class, e.g. Barrel_PC
+              clamp_type (str): type of input, ['current' or 'dynamic']
+              dt (float): time step of the simulation in miliseconds.
+              tracking (tuple): variables recorded by the StateMonitor.
+              n, population: see Barrel_PC
+
+        OUTPUT:
+              model: Barrel_PC or Barrel_IN instance, shared with every caller that asks
+                     for the same model. The monitors are reset by the next get_model,
+                     so copy what is needed out of them before that.
+    '''
+    if isinstance(model, str):
+        if model not in MODELS:
+            raise ValueError('Model must be \'PC\' or \'IN\'')
+        model = MODELS[model]
+    if clamp_type not in ('current', 'dynamic'):
+        raise ValueError('Clamp type must be \'current\' or \'dynamic\'')
+
+    if b2.prefs.codegen.runtime.cython.cache_dir is None:
+        set_cache_dir()
+
+    key = (model, clamp_type, float(dt), tuple(tracking), n, population)
+    if key in _models:
+        neuron = _models[key]
+        neuron.restore()
+    else:
+        neuron = model(clamp_type, dt=dt, n=n, population=population, tracking=tracking)
+        neuron.store()
+        _models[key] = neuron
+    return neuron
+
+
+def clear_models(compiled=False, cache_dir=CACHE_DIR):
+    ''' Forgets all built models, and with compiled=True also removes the compiled
+        code from cache_dir.
+    '''
+    _models.clear()
+    if compiled and os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+        os.makedirs(cache_dir)
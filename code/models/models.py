@@ -5,6 +5,7 @@
 import brian2 as b2
 import matplotlib.pyplot as plt
 import numpy as np
+from models.parameters import get_parameters
 
 def simulate_Wang_Buszaki(inj_input, simulation_time, clamp_type='current'):
     ''' Hodgkin-Huxley model of a hippocampal (CA1) interneuron.
@@ -88,6 +89,11 @@ class Barrel_PC:
         INPUT:
             clamp_type (str): type of input, ['current' or 'dynamic']
             dt (float): time step of the simulation in miliseconds.
+            n (int): number of copies of the neuron, each with its own input scale
+                     (neuron.scale, default 1) on the same input.
+            population (bool): simulate every fitted parameter set at once, neuron i 
+                               (and index i of the monitors) is parameter set i.
+            tracking (tuple): variables recorded by the StateMonitor.
 
         OUTPUT:
             StateMonitor, SpikeMonitor: Brian2 StateMonitor with recorded fields
@@ -99,22 +105,27 @@ class Barrel_PC:
         transfer in inhibitory and excitatory neurons of rat barrel cortex, but shows no clear
         influence on neuronal parameters. (Unpublished bachelor's thesis)
     '''
-    def __init__(self, clamp_type, dt=0.5):
+    def __init__(self, clamp_type, dt=0.5, n=1, population=False, tracking=('v', 'I_inj')):
         self.clamp_type = clamp_type
         self.dt = dt
+        self.tracking = list(tracking)
+        self.parameters = get_parameters('PC')
+        self.population = population
+        self.n = len(self.parameters) if population else n
         self.stored = False
         self.make_model()
     
     def make_model(self):
         # Determine the simulation
         if self.clamp_type == 'current':
-            eqs_input = '''I_inj = inj_input(t) : amp'''
+            eqs_input = '''I_inj = scale * inj_input(t) : amp'''
 
         elif self.clamp_type =='dynamic':
-            eqs_input = '''I_exc = g_exc(t) * (v - Er_e) : amp
-                    I_inh = g_inh(t) * (v - Er_i) : amp
+            eqs_input = '''I_exc = scale * g_exc(t) * (v - Er_e) : amp
+                    I_inh = scale * g_inh(t) * (v - Er_i) : amp
                     I_inj = I_exc + I_inh : amp'''
-        tracking = ['v', 'I_inj']
+        eqs_input += '''
+                    scale : 1 (constant)'''
         
         # Model the neuron with differential equations
         eqs = '''
@@ -131,15 +142,25 @@ class Barrel_PC:
             I_K = -gK * n**4 * (v - EK) : amp
 
             dv/dt = (I_leak + I_Na + I_K + I_inj) / Cm : volt
+
+            # Fitted parameters
+            gL : siemens (constant)
+            gK : siemens (constant)
+            gNa : siemens (constant)
+            Cm : farad (constant)
+            k_m : volt (constant)
+            k_h : volt (constant)
+            Vh_h : volt (constant)
             '''    
 
         # Neuron & parameter initialization
-        neuron = b2.NeuronGroup(1, model=eqs+eqs_input, method='exponential_euler',
+        neuron = b2.NeuronGroup(self.n, model=eqs+eqs_input, method='exponential_euler',
                             threshold ='m > 0.5', refractory=2*b2.ms, reset=None, dt=self.dt*b2.ms)
         neuron.v = -65*b2.mV
+        neuron.scale = 1
 
         # Track the parameters during simulation
-        self.M = b2.StateMonitor(neuron, tracking, record=True)
+        self.M = b2.StateMonitor(neuron, self.tracking, record=True)
         self.S = b2.SpikeMonitor(neuron, record=True)
         self.neuron = neuron
 
@@ -154,40 +175,43 @@ class Barrel_PC:
     def restore(self):
         self.network.restore()
 
-    def run(self, inj_input, simulation_time, Ni=None):
+    def run(self, inj_input, simulation_time, Ni=None, rng=None):
         ''' Run simulation.
 
             INPUT
             inj_input ((Tuple of) TimedArray): input current or conductances (g_exc, g_inh)
             simulation_time (float): simulation time [milliseconds]
-            Ni (int): neuron index
+            Ni (int): neuron index, ignored in population mode
+            rng (optional): numpy Generator or seed used to pick Ni if it is not given
 
             OUTPUT
             StateMonitor, SpikeMonitor: brian2 classes containing neuron information
         '''
         # Neuron parameters
-        ## Pick a random set of parameters
-        parameters = np.loadtxt('parameters/PC_parameters.csv', delimiter=',')
-        if Ni == None:
-            Ni = np.random.randint(np.shape(parameters)[1])
+        ## Pick a random set of parameters (or all in population mode)
+        parameters = self.parameters
+        if self.population:
+            Ni = slice(None)
+        elif Ni == None:
+            Ni = np.random.default_rng(rng).integers(len(parameters))
         
         if self.clamp_type =='dynamic':
             g_exc, g_inh = inj_input
 
         ## Initiate parameters
         area = 20000*b2.umetre**2
-        Cm = parameters[2][Ni]*b2.farad/area * b2.cm**2 
-        gL = parameters[0][Ni]*b2.siemens/area * b2.cm**2 
-        gNa = parameters[3][Ni]*b2.siemens/area * b2.cm**2 
-        gK = parameters[1][Ni]*b2.siemens/area * b2.cm**2 
+        self.neuron.Cm = parameters['Cm'][Ni]/area * b2.cm**2
+        self.neuron.gL = parameters['gL'][Ni]/area * b2.cm**2
+        self.neuron.gNa = parameters['gNa'][Ni]/area * b2.cm**2
+        self.neuron.gK = parameters['gK'][Ni]/area * b2.cm**2
         EL = -65*b2.mV
         ENa = 50*b2.mV
         EK = -90*b2.mV
         Er_e = 0*b2.mV
         Er_i = -75*b2.mV
-        k_m = parameters[4][Ni]*b2.volt
-        k_h = parameters[5][Ni]*b2.volt
-        Vh_h = parameters[6][Ni]*b2.volt
+        self.neuron.k_m = parameters['k_m'][Ni]
+        self.neuron.k_h = parameters['k_h'][Ni]
+        self.neuron.Vh_h = parameters['Vh_h'][Ni]
         VT = -63*b2.mV
    
         self.network.run(simulation_time*b2.ms)
@@ -201,6 +225,11 @@ class Barrel_IN:
         INPUT:
             clamp_type (str): type of input, ['current' or 'dynamic']
             dt (float): time step of the simulation in miliseconds.
+            n (int): number of copies of the neuron, each with its own input scale
+                     (neuron.scale, default 1) on the same input.
+            population (bool): simulate every fitted parameter set at once, neuron i 
+                               (and index i of the monitors) is parameter set i.
+            tracking (tuple): variables recorded by the StateMonitor.
 
         OUTPUT:
             StateMonitor, SpikeMonitor: Brian2 StateMonitor with recorded fields
@@ -212,22 +241,27 @@ class Barrel_IN:
         transfer in inhibitory and excitatory neurons of rat barrel cortex, but shows no clear
         influence on neuronal parameters. (Unpublished bachelor's thesis)
     '''
-    def __init__(self, clamp_type, dt=0.5):
+    def __init__(self, clamp_type, dt=0.5, n=1, population=False, tracking=('v', 'I_inj')):
         self.clamp_type = clamp_type
         self.dt = dt
+        self.tracking = list(tracking)
+        self.parameters = get_parameters('IN')
+        self.population = population
+        self.n = len(self.parameters) if population else n
         self.stored = False
         self.make_model()
     
     def make_model(self):
         # Determine the simulation
         if self.clamp_type == 'current':
-            eqs_input = '''I_inj = inj_input(t) : amp'''
+            eqs_input = '''I_inj = scale * inj_input(t) : amp'''
 
         elif self.clamp_type =='dynamic':
-            eqs_input = '''I_exc = g_exc(t) * (v - Er_e) : amp
-                    I_inh = g_inh(t) * (v - Er_i) : amp
+            eqs_input = '''I_exc = scale * g_exc(t) * (v - Er_e) : amp
+                    I_inh = scale * g_inh(t) * (v - Er_i) : amp
                     I_inj = I_exc + I_inh : amp'''
-        tracking = ['v', 'I_inj']
+        eqs_input += '''
+                    scale : 1 (constant)'''
         
         # Model the neuron with differential equations
         eqs = '''
@@ -256,15 +290,24 @@ class Barrel_IN:
                 I_K = -gK * n**4 * (v - EK) : amp
                 I_K3 = -gK3 * n3**4 * (v - EK) : amp
                 dv/dt = (I_leak + I_Na + I_K + I_K3 + I_inj) / Cm : volt
+
+                # Fitted parameters
+                gL : siemens (constant)
+                gK : siemens (constant)
+                gNa : siemens (constant)
+                gK3 : siemens (constant)
+                Cm : farad (constant)
+                k : volt (constant)
              '''    
 
         # Neuron & parameter initialization
-        neuron = b2.NeuronGroup(1, model=eqs+eqs_input, method='exponential_euler',
+        neuron = b2.NeuronGroup(self.n, model=eqs+eqs_input, method='exponential_euler',
                             threshold ='m > 0.5', refractory=2*b2.ms, reset=None, dt=self.dt*b2.ms)
         neuron.v = -65*b2.mV
+        neuron.scale = 1
 
         # Track the parameters during simulation
-        self.M = b2.StateMonitor(neuron, tracking, record=True)
+        self.M = b2.StateMonitor(neuron, self.tracking, record=True)
         self.S = b2.SpikeMonitor(neuron, record=True)
         self.neuron = neuron
 
@@ -279,23 +322,25 @@ class Barrel_IN:
     def restore(self):
         self.network.restore()
 
-    def run(self, inj_input, simulation_time, Ni=None):
+    def run(self, inj_input, simulation_time, Ni=None, rng=None):
         ''' Run simulation.
 
             INPUT
             inj_input ((Tuple of) TimedArray): input current or conductances (g_exc, g_inh)
             simulation_time (float): simulation time [milliseconds]
-            Ni (int): neuron index
+            Ni (int): neuron index, ignored in population mode
+            rng (optional): numpy Generator or seed used to pick Ni if it is not given
 
             OUTPUT
             StateMonitor, SpikeMonitor: brian2 classes containing neuron information
         '''
         # Neuron parameters
-        ## Pick a random set of parameters
-        parameters = np.loadtxt('parameters/IN_parameters.csv', delimiter=',')
-
-        if Ni == None:
-            Ni = np.random.randint(np.shape(parameters)[1])
+        ## Pick a random set of parameters (or all in population mode)
+        parameters = self.parameters
+        if self.population:
+            Ni = slice(None)
+        elif Ni == None:
+            Ni = np.random.default_rng(rng).integers(len(parameters))
 
         if self.clamp_type =='dynamic':
             g_exc, g_inh = inj_input
@@ -303,17 +348,17 @@ class Barrel_IN:
         ## Initiate parameters
         param = np.log(10)
         area = 20000*b2.umetre**2
-        Cm = parameters[2][Ni]*b2.farad/area * b2.cm**2 
-        gL = parameters[0][Ni]*b2.siemens/area * b2.cm**2 
-        gNa = parameters[3][Ni]*b2.siemens/area * b2.cm**2 
-        gK = parameters[1][Ni]*b2.siemens/area * b2.cm**2 
-        gK3 = parameters[5][Ni]*b2.siemens/area * b2.cm**2 
+        self.neuron.Cm = parameters['Cm'][Ni]/area * b2.cm**2
+        self.neuron.gL = parameters['gL'][Ni]/area * b2.cm**2
+        self.neuron.gNa = parameters['gNa'][Ni]/area * b2.cm**2
+        self.neuron.gK = parameters['gK'][Ni]/area * b2.cm**2
+        self.neuron.gK3 = parameters['gK3'][Ni]/area * b2.cm**2
         EL = -65*b2.mV
         ENa = 50*b2.mV
         EK = -90*b2.mV
         Er_e = 0*b2.mV
         Er_i = -75*b2.mV
-        k = parameters[4][Ni]*b2.volt
+        self.neuron.k = parameters['k'][Ni]
         
         self.network.run(simulation_time*b2.ms)
         return self.M, self.S
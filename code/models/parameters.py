@@ -0,0 +1,83 @@
+''' parameters.py
+
+    Registry of the fitted neuron parameters of Barrel_PC and Barrel_IN. Every table is
+    parsed once per process (from a binary .npy cache next to the CSV when it is up to date)
+    and shared by all models, with named and unit-annotated rows.
+'''
+import os
+import brian2 as b2
+import numpy as np
+
+PARAMETER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'parameters')
+
+# Named rows of the parameter tables and their units, the other rows are only in the table
+ROWS = {'PC' : {'gL' : (0, b2.siemens), 'gK' : (1, b2.siemens), 'Cm' : (2, b2.farad),
+                'gNa' : (3, b2.siemens), 'k_m' : (4, b2.volt), 'k_h' : (5, b2.volt),
+                'Vh_h' : (6, b2.volt)},
+        'IN' : {'gL' : (0, b2.siemens), 'gK' : (1, b2.siemens), 'Cm' : (2, b2.farad),
+                'gNa' : (3, b2.siemens), 'k' : (4, b2.volt), 'gK3' : (5, b2.siemens)}}
+
+_registry = {}
+
+class ParameterTable:
+    ''' Fitted parameters of one cell type, a column per neuron (parameter set).
+
+        INPUT:
+              cell_type (str): 'PC' or 'IN'
+              table (array): (nrows x nneurons) parameters in SI units
+
+        table['gL'] gives the row with its unit (brian2 Quantity), table.values('gL')
+        the plain array.
+    '''
+    def __init__(self, cell_type, table):
+        self.cell_type = cell_type
+        self.table = table
+        self.rows = ROWS[cell_type]
+
+    def __len__(self):
+        return np.shape(self.table)[1]
+
+    def __getitem__(self, name):
+        row, unit = self.rows[name]
+        return self.table[row]*unit
+
+    def values(self, name):
+        return self.table[self.rows[name][0]]
+
+    def units(self, name):
+        return self.rows[name][1]
+
+
+def get_parameters(cell_type, cache=True):
+    ''' Returns the ParameterTable of cell_type ('PC' or 'IN'), parsed once per process.
+
+        INPUT:
+              cell_type (str): 'PC' or 'IN'
+              cache (bool): read (and write) the binary PC/IN_parameters.npy next to the
+                            CSV instead of parsing the CSV, when it is newer than the CSV.
+    '''
+    if cell_type not in ROWS:
+        raise ValueError('Cell type must be \'PC\' or \'IN\'')
+    if cell_type not in _registry:
+        _registry[cell_type] = ParameterTable(cell_type, _load_table(cell_type, cache))
+    return _registry[cell_type]
+
+
+def _load_table(cell_type, cache):
+    ''' Loads the parameter table from the .npy cache or the CSV.
+    '''
+    csv_path = os.path.join(PARAMETER_DIR, f'{cell_type}_parameters.csv')
+    npy_path = os.path.join(PARAMETER_DIR, f'{cell_type}_parameters.npy')
+    if cache and os.path.exists(npy_path) and os.path.getmtime(npy_path) >= os.path.getmtime(csv_path):
+        table = np.load(npy_path)
+    else:
+        table = np.loadtxt(csv_path, delimiter=',')
+        if cache:
+            try:
+                np.save(npy_path, table)
+            except OSError:
+                pass
+
+    # Shared by all models, so read-only
+    table.setflags(write=False)
+    return table
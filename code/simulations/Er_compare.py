@@ -13,7 +13,7 @@ import numpy as np
 from foundations.make_dynamic_experiments import make_dynamic_experiments
 from foundations.MI_calculation import analyze_exp
 from visualization.plotter import plot_dynamicclamp, plot_currentclamp
-from models.models import Barrel_PC
+from models.factory import get_model
 from brian2 import *
 from foundations.helpers import scale_dynamic_input, make_spiketrain, scale_input_theory
 from visualization.plotter import plot_scaling_compare
@@ -53,7 +53,7 @@ for i in range(N_runs):
     print('Input and hiddenstate generate!')
 
     # Current Clamp 
-    current_neuron = Barrel_PC('current', dt)
+    current_neuron = get_model('PC', 'current', dt)
     current_inj = scale_input_theory(input_theory, baseline, amplitude_scaling, dt)
     current_M, current_S = current_neuron.run(current_inj, duration*ms, 1, Er_exc, Er_inh)
     current_inputs = np.concatenate((current_inputs, current_M.I_inj[0]/uA), axis=0)
@@ -61,8 +61,7 @@ for i in range(N_runs):
     current_freq = np.concatenate((current_freq, [current_S.num_spikes/(duration/1000)]), axis=0)
 
     # Dynamic Clamp
-    dynamic_neuron = Barrel_PC('dynamic', dt)
-    dynamic_neuron.store()
+    dynamic_neuron = get_model('PC', 'dynamic', dt)
 
     # Dynamic Clamp with different Er_inh
     for Er_inh in Er_inh_array:
@@ -109,12 +109,6 @@ for _ in range(5):
 # Save ISI dictionary
 np.save(f'results/saved/ISI_compare/ISI_test.npy', ISI)
 
-# Clear Brian2 cache
-try:
-    clear_cache('cython')
-except:
-    pass
-
 # # Plot
 # fig, axs = plt.subplots(nrows=2, ncols=2, figsize=(10,10))
 # sns.histplot(ISI['current_PC']['on'], ax=axs[0, 0], kde=True, kde_kws={'bw_adjust':2.5}, bins=50, color='red')
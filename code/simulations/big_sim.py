@@ -6,8 +6,8 @@ current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentfra
 parent_dir = os.path.dirname(current_dir)
 sys.path.insert(0, parent_dir)
 
-from brian2 import clear_cache, uA, mV, ms
-from models.models import Barrel_PC, Barrel_IN
+from brian2 import uA, mV, ms
+from models.factory import get_model
 from foundations.helpers import scale_to_freq
 from foundations.make_dynamic_experiments import make_dynamic_experiments
 import numpy as np
@@ -36,10 +36,8 @@ on_off_ratio = 1.5
 
 # Initiate Pyramidal cell models
 PC_i = 35
-current_PC = Barrel_PC('current', dt=dt)
-dynamic_PC = Barrel_PC('dynamic', dt=dt)
-current_PC.store()
-dynamic_PC.store()
+current_PC = get_model('PC', 'current', dt=dt)
+dynamic_PC = get_model('PC', 'dynamic', dt=dt)
 
 # Create results DataFrame
 vars_to_track = ['input_theory', 'dynamic_theory', 'hidden_state',
@@ -77,18 +75,10 @@ while succesful_runs < 10:
     # Keep count
     succesful_runs += 1
 
-# Keep it clean
-try:
-    clear_cache('cython')
-except:
-    pass
-
 # Initiate Interneuron models
 IN_i = 11
-current_IN = Barrel_IN('current', dt=dt)
-dynamic_IN = Barrel_PC('dynamic', dt=dt)
-current_IN.store()
-dynamic_IN.store()
+current_IN = get_model('IN', 'current', dt=dt)
+dynamic_IN = get_model('IN', 'dynamic', dt=dt)
 
 # Create results DataFrame
 results_IN = pd.DataFrame(columns=vars_to_track)
@@ -126,9 +116,3 @@ while succesful_runs < 10:
 # Save data
 results_PC.to_pickle('results/results_PC.pkl')
 results_IN.to_pickle('results/results_IN.pkl')
-
-# Clean cache
-try:
-    clear_cache('cython')
-except:
-    pass
@@ -14,7 +14,7 @@ from brian2 import *
 from foundations.make_dynamic_experiments import make_dynamic_experiments
 from models.models import *
 from visualization.plotter import plot_currentclamp, plot_dynamicclamp, plot_compare
-from foundations.MI_calculation import analyze_exp
+from foundations.MI_calculation import analyze_exp_batch, save_analysis
 from foundations.helpers import scale_input_theory, scale_to_freq, make_spiketrain
 from models.models import Barrel_PC
 import seaborn as sns
@@ -41,7 +41,8 @@ on_off_ratio = 1.5
 
 ## Simulate
 # Pyramidal cells
-MI = {'PC_current' : [], 'PC_dynamic' : [], 'IN_current' : [], 'IN_dynamic' : []}
+# Hidden state, input and spiketrain of every run, analysed at once after the simulation
+runs = {group : {'x' : [], 'input' : [], 'spikes' : []} for group in ('PC_current', 'PC_dynamic', 'IN_current', 'IN_dynamic')}
 print('Running simulation...')
 
 current_barrel_PC = Barrel_PC('current', dt=dt)
@@ -81,11 +82,11 @@ for _ in range(25):
             spiketrain_current = make_spiketrain(S_current, hidden_state, dt)
             spiketrain_dynamic = make_spiketrain(S_dynamic, hidden_state, dt)
             
-            # Calculate MI
-            Output_current = analyze_exp(ron, roff, hidden_state, input_theory, dt, theta, spiketrain_current)
-            Output_dynamic = analyze_exp(ron, roff, hidden_state, input_theory, dt, theta, spiketrain_dynamic)
-            MI['PC_current'].append(Output_current)
-            MI['PC_dynamic'].append(Output_dynamic)
+            # Collect for the MI calculation
+            for group, spiketrain in (('PC_current', spiketrain_current), ('PC_dynamic', spiketrain_dynamic)):
+                runs[group]['x'].append(hidden_state)
+                runs[group]['input'].append(input_theory)
+                runs[group]['spikes'].append(spiketrain[0])
             
             # # Sanity check
             # print(Output_dynamic['MI'])
@@ -115,20 +116,29 @@ for _ in range(25):
             spiketrain_current = make_spiketrain(S_current, hidden_state, dt)
             spiketrain_dynamic = make_spiketrain(S_dynamic, hidden_state, dt)
 
-            # Calculate MI
-            Output_current = analyze_exp(ron, roff, hidden_state, input_theory, dt, theta, spiketrain_current)
-            Output_dynamic = analyze_exp(ron, roff, hidden_state, input_theory, dt, theta, spiketrain_dynamic)
-            MI['IN_current'].append(Output_current)
-            MI['IN_dynamic'].append(Output_dynamic)
+            # Collect for the MI calculation
+            for group, spiketrain in (('IN_current', spiketrain_current), ('IN_dynamic', spiketrain_dynamic)):
+                runs[group]['x'].append(hidden_state)
+                runs[group]['input'].append(input_theory)
+                runs[group]['spikes'].append(spiketrain[0])
 
-print('Simulation complete, saving files')
+print('Simulation complete, calculating MI')
+
+# Calculate MI of all runs per group, one row per run
+MI = {}
+for group, run in runs.items():
+    if len(run['spikes']) > 0:
+        MI[group], _ = analyze_exp_batch(ron, roff, np.stack(run['x']), np.stack(run['input']), dt, theta, np.stack(run['spikes']))
+
+print('Saving files')
 
 # Save files
 np.savetxt(f'results/saved/clamp_compare2/hiddenstate.csv', hidden_state, delimiter=',')
 np.savetxt(f'results/saved/clamp_compare2/input_theory.csv', input_theory, delimiter=',')
 np.savetxt(f'results/saved/clamp_compare2/spiketrain_current.csv', spiketrain_current, delimiter=',')
 np.savetxt(f'results/saved/clamp_compare2/spiketrain_dynamic.csv', spiketrain_dynamic, delimiter=',')
-np.save(f'results/saved/clamp_compare2/MI.npy', MI) 
+for group, results in MI.items():
+    save_analysis(f'results/saved/clamp_compare2/MI_{group}', results)
 #     # # Sanity check
 #     # print(Output_dynamic['MI'])
 #     # plot_dynamicclamp(M_dynamic, g_exc, g_inh, hidden_state, dt=dt)
@@ -9,7 +9,7 @@ sys.path.insert(0, parent_dir)
 
 from foundations.make_dynamic_experiments import make_dynamic_experiments
 from foundations.helpers import scale_input_theory
-from models.models import Barrel_PC, Barrel_IN
+from models.factory import get_model
 from visualization.plotter import plot_dt_compare
 from brian2 import *
 from visualization.plotter import plot_currentclamp
@@ -47,9 +47,9 @@ for _ in range(N_runs):
         # Scale input
         inj_input = scale_input_theory(input_theory, baseline, amplitude_scaling, 1/sampling_rate)
 
-        # Initialize neuron
-        PC = Barrel_PC(clamp_type='current', dt=1/sampling_rate)
-        IN = Barrel_IN(clamp_type='current', dt=1/sampling_rate)
+        # Get the (cached) neurons for this dt
+        PC = get_model('PC', 'current', dt=1/sampling_rate)
+        IN = get_model('IN', 'current', dt=1/sampling_rate)
 
         # Run simulation
         PC_M, PC_S = PC.run(inj_input, duration*ms, 1, Er_exc, Er_inh)
@@ -9,9 +9,10 @@ sys.path.insert(0, parent_dir)
 
 import numpy as np
 from foundations.make_dynamic_experiments import make_dynamic_experiments
+from foundations.cache import cached_dynamic_experiments
 from foundations.MI_calculation import analyze_exp
 from visualization.plotter import plot_dynamicclamp, plot_currentclamp
-from models.models import Barrel_PC
+from models.factory import get_model
 from brian2 import *
 from foundations.helpers import scale_dynamic_input, make_spiketrain, scale_input_theory
 from visualization.plotter import plot_scaling_compare
@@ -33,6 +34,7 @@ duration = 2000
 qon_qoff_type = 'balanced'
 Er_exc, Er_inh = (0, -90)
 N_runs = 10 # for all pyramidal and interneuron parameters
+seed = 1
 
 scale_exc_inh = [1, 5, 7.5, 10, 15, 20]
 scaled_inputs = dict.fromkeys(scale_exc_inh, [])
@@ -43,10 +45,8 @@ current_inputs = []
 current_Vm = []   
 current_freq = [] 
 
-g_exc = loadtxt('results/saved/test/g_exc.csv', delimiter=',')
-g_inh = np.loadtxt('results/saved/test/g_inh.csv', delimiter=',')
-input_theory = np.loadtxt('results/saved/test/input_theory.csv', delimiter=',')
-hidden_state = np.loadtxt('results/saved/test/hidden_state.csv', delimiter=',')
+# Generated once, later runs load it from the experiment cache
+input_theory, (g_exc, g_inh), hidden_state = cached_dynamic_experiments(qon_qoff_type, baseline, tau, factor_ron_roff, mean_firing_rate, sampling_rate, duration, seed)
 
 for i in range(N_runs):
     # Generate 
@@ -55,11 +55,10 @@ for i in range(N_runs):
     # [g_exc, g_inh, input_theory, hidden_state] = make_dynamic_experiments(qon_qoff_type, baseline, amplitude_scaling, tau, factor_ron_roff, mean_firing_rate, sampling_rate, duration, dv)
     # print('Input and hiddenstate generate!')
 
-    dynamic_neuron = Barrel_PC('dynamic', dt)
-    dynamic_neuron.store()
+    dynamic_neuron = get_model('PC', 'dynamic', dt)
 
     # Current Clamp 
-    current_neuron = Barrel_PC('current', dt)
+    current_neuron = get_model('PC', 'current', dt)
     current_inj = scale_input_theory(input_theory, baseline, amplitude_scaling, dt)
     current_M, current_S = current_neuron.run(current_inj, duration*ms, 1, Er_exc, Er_inh)
     current_inputs = np.concatenate((current_inputs, current_M.I_inj[0]/uA), axis=0)
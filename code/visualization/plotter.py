@@ -79,13 +79,14 @@ def plot_special(axes, array, mini, maxi, col=None, label=None):
 
 
 def plot_clampcell_MI(MI_data):
-    ''' Plot the results of the clamp comparison simulation0
+    ''' Plot the results of the clamp comparison simulation0, MI_data has the
+        analyze_exp_batch results table per group.
     '''
     # Load Data
-    MI_PC_current = [run['MI'] for run in MI_data['PC_current']]
-    MI_PC_dynamic = [run['MI'] for run in MI_data['PC_dynamic']]
-    MI_IN_current = [run['MI'] for run in MI_data['IN_current']]
-    MI_IN_dynamic = [run['MI'] for run in MI_data['IN_dynamic']]
+    MI_PC_current = MI_data['PC_current']['MI']
+    MI_PC_dynamic = MI_data['PC_dynamic']['MI']
+    MI_IN_current = MI_data['IN_current']['MI']
+    MI_IN_dynamic = MI_data['IN_dynamic']['MI']
 
     ## Statistical data
     PC_N = len(MI_PC_current)